@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the randomizer overhead using the fake generator instead of the LVGL binary
+
+Every stage runs in a fresh process on synthetic data and reports its throughput and peak RSS.
+
+Usage: python bench/benchmark.py [-n 1000 10000 100000] [-s capture dataset replace normalize labels coco] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(bench_dir), 'src'))
+
+import ui_randomizer
+from util import replace
+from util import normalize
+from util import labels
+from util import yolo_to_coco
+
+fake_generator = os.path.join(bench_dir, 'fake_generator.py')
+stages = ['capture', 'dataset', 'replace', 'normalize', 'labels', 'coco']
+widget_list = ui_randomizer.default_widget_list
+class_names = [ui_randomizer.classes[widget]['name'] for widget in widget_list]
+
+def write_synthetic_samples(folder: str, samples: int, width: int, height: int, widget_count: int,
+                            images: bool = True, class_ids: bool = False, normalized: bool = False) -> None:
+    """
+    Write synthetic label files in the format of the generator (and copies of a template image) into folder
+    """
+    os.makedirs(folder, exist_ok=True)
+    template = os.path.join(folder, '.template.jpg')
+    if images:
+        from PIL import Image
+        Image.new('RGB', (width, height), (255, 255, 255)).save(template, 'JPEG')
+    rng = random.Random(0)
+    for i in range(samples):
+        name = f"ui_{i}"
+        with open(os.path.join(folder, f"{name}.txt"), 'w') as f:
+            for _ in range(widget_count):
+                class_index = rng.randrange(len(class_names))
+                w, h = rng.randint(10, width // 3), rng.randint(10, height // 3)
+                box = (rng.randint(0, width - w) + w / 2, rng.randint(0, height - h) + h / 2, w, h)
+                if normalized:
+                    box = (box[0] / width, box[1] / height, box[2] / width, box[3] / height)
+                f.write(f"{class_index if class_ids else class_names[class_index]} {' '.join(str(x) for x in box)}\n")
+        if images:
+            shutil.copyfile(template, os.path.join(folder, f"{name}.jpg"))
+    if images:
+        os.remove(template)
+
+def run_stage(stage: str, samples: int, folder: str, options: dict) -> dict:
+    """
+    Prepare the input of a stage, run and time it
+
+    Returns the elapsed time and the peak RSS of the process
+    """
+    width, height, widget_count = options['width'], options['height'], options['widget_count']
+    raw_folder = os.path.join(folder, 'raw')
+    if stage == 'capture':
+        start = time.perf_counter()
+        ui_randomizer.capture_ui(app=fake_generator, output_folder=os.path.join(folder, 'capture'), width=width, height=height, iterations=samples,
+                                 widget_list=widget_list, widget_count=widget_count, delay_count=0, split_widgets=False,
+                                 workers=options['workers'], seed=0)
+    elif stage == 'dataset':
+        write_synthetic_samples(raw_folder, samples, width, height, widget_count)
+        images = [os.path.join(raw_folder, f"ui_{i}.jpg") for i in range(samples)]
+        start = time.perf_counter()
+        ui_randomizer.dataset_generation(os.path.join(folder, 'dataset'), 'bench', images, width, height, class_names)
+    elif stage == 'replace':
+        write_synthetic_samples(raw_folder, samples, width, height, widget_count, images=False)
+        start = time.perf_counter()
+        replace.replace_class_names_with_id_in_dirs(class_names, [raw_folder])
+    elif stage == 'normalize':
+        write_synthetic_samples(raw_folder, samples, width, height, widget_count, images=False, class_ids=True)
+        start = time.perf_counter()
+        normalize.normalize_bbox_in_label_files_of_dirs(width, height, [raw_folder])
+    elif stage == 'labels':
+        write_synthetic_samples(raw_folder, samples, width, height, widget_count, images=False)
+        start = time.perf_counter()
+        labels.fix_label_files_in_dirs(class_names, width, height, [raw_folder])
+    elif stage == 'coco':
+        write_synthetic_samples(raw_folder, samples, width, height, widget_count, class_ids=True, normalized=True)
+        start = time.perf_counter()
+        yolo_to_coco.yolo_to_coco_annotation(raw_folder, raw_folder, os.path.join(folder, 'annotations'), 'instances.json',
+                                             class_names=class_names, image_size=(width, height))
+    else:
+        raise ValueError(f"Unknown stage {stage}")
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    return {'seconds': elapsed, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+def benchmark(stage: str, samples: int, options: dict) -> dict:
+    """
+    Run a stage in a fresh process on a temporary folder
+    """
+    with tempfile.TemporaryDirectory(dir=options['tmp_dir']) as folder, \
+            ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        result = executor.submit(run_stage, stage, samples, folder, options).result()
+    result.update(stage=stage, samples=samples, samples_per_second=samples / result['seconds'] if result['seconds'] > 0 else float('inf'))
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the randomizer overhead with a fake generator')
+    parser.add_argument('-n', '--samples', type=int, nargs='+', default=[1000, 10000, 100000], help='Amounts of samples to benchmark')
+    parser.add_argument('-s', '--stages', nargs='+', choices=stages, default=stages, help='Stages to benchmark')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='Number of generator processes for the capture stage')
+    parser.add_argument('-c', '--widget_count', type=int, default=3, help='Number of widgets per sample')
+    parser.add_argument('--width', type=int, default=250, help='Width of the samples')
+    parser.add_argument('--height', type=int, default=250, help='Height of the samples')
+    parser.add_argument('--tmp_dir', default=None, help='Folder for the temporary benchmark data')
+    parser.add_argument('--json', default=None, help='Write the results as JSON into this file')
+    args = parser.parse_args()
+
+    options = {'width': args.width, 'height': args.height, 'widget_count': args.widget_count, 'workers': args.workers, 'tmp_dir': args.tmp_dir}
+    results = []
+    print(f"{'stage':<10} {'samples':>8} {'seconds':>10} {'samples/s':>12} {'peak RSS MB':>12}")
+    for samples in args.samples:
+        for stage in args.stages:
+            result = benchmark(stage, samples, options)
+            results.append(result)
+            print(f"{stage:<10} {samples:>8} {result['seconds']:>10.3f} {result['samples_per_second']:>12.1f} {result['peak_rss_mb']:>12.1f}", flush=True)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the random UI generator binary
+
+Accepts the same arguments as the generator (-w -h -c -t -o -d -l) and writes a synthetic JPEG
+with random widget rectangles and a label file with the boxes in pixels, named like the generator does.
+
+The delay of the binary is simulated with FAKE_GENERATOR_TICK seconds per delay count (default: 0).
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from PIL import Image
+from PIL import ImageDraw
+
+# Names of the widgets as written by the generator into the label files
+widget_names = {
+    "button": "lv_btn",
+    "checkbox": "lv_checkbox",
+    "label": "lv_label",
+    "slider": "lv_slider",
+    "switch": "lv_switch",
+    "progressbar": "lv_bar",
+}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Fake random UI generator', add_help=False)
+    parser.add_argument('-w', dest='width', type=int, required=True)
+    parser.add_argument('-h', dest='height', type=int, required=True)
+    parser.add_argument('-c', dest='count', type=int, required=True)
+    parser.add_argument('-t', dest='types', required=True)
+    parser.add_argument('-o', dest='output', required=True)
+    parser.add_argument('-d', dest='delay', type=int, default=0)
+    parser.add_argument('-l', dest='layout', default='none')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    time.sleep(float(os.environ.get('FAKE_GENERATOR_TICK', '0')) * args.delay)
+    # The generator writes relative to its working directory
+    image_path = os.getcwd() + args.output
+    image = Image.new('RGB', (args.width, args.height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    lines = []
+    for _ in range(args.count):
+        name = widget_names[random.choice(args.types.split(','))]
+        w = random.randint(10, max(10, args.width // 3))
+        h = random.randint(10, max(10, args.height // 3))
+        x = random.randint(0, args.width - w)
+        y = random.randint(0, args.height - h)
+        draw.rectangle((x, y, x + w, y + h), fill=tuple(random.randrange(256) for _ in range(3)))
+        lines.append(f"{name} {x + w / 2} {y + h / 2} {w} {h}\n")
+    image.save(image_path, 'JPEG')
+    with open(os.path.splitext(image_path)[0] + '.txt', 'w') as f:
+        f.writelines(lines)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
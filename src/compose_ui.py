@@ -0,0 +1,45 @@
+# compose_ui.py
+import os
+import sys
+import argparse
+import logging
+
+import ui_randomizer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compose multi-widget UIs from single-widget renders without the generator binary.')
+    parser.add_argument('-s', '--sources', required=True, nargs='+', help='Datasets of single-widget UIs (e.g. created with --single) or render cache folders')
+    parser.add_argument('-i', '--iterations', type=int, default=10, help='Number of UIs to compose')
+    parser.add_argument('-t', '--widget_types', required=True, nargs='+', help='List of widgets to be used in the UI')
+    parser.add_argument('-m', '--multi', type=int, required=True, help='Number of widgets per UI')
+    parser.add_argument('--width', type=int, default=250, help='Width of the UI')
+    parser.add_argument('--height', type=int, default=250, help='Height of the UI')
+    parser.add_argument('-o', '--output_folder', required=True, help='Folder to save the output images')
+    parser.add_argument('-r', '--split_ratio', type=ui_randomizer.parse_split_ratio, default=None, help='Split ratio for train, val, test (e.g. 0.7,0.1,0.2)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the split assignment and the composition')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of processes composing UIs (default: number of CPUs)')
+    parser.add_argument('--coco', action='store_true', help='Additionally export COCO annotation files for every split')
+    parser.add_argument('--metrics', default=None, help='Write per-stage timings and counters of the run into this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    for widget in args.widget_types:
+        if widget not in ui_randomizer.classes.keys():
+            print(f"Widget type {widget} not supported. Please use one of the following: {', '.join(ui_randomizer.classes.keys())}")
+            sys.exit(1)
+
+    ui_randomizer.compose_ui(
+        source_folders=[os.path.abspath(folder) for folder in args.sources],
+        output_folder=os.path.abspath(args.output_folder),
+        width=args.width,
+        height=args.height,
+        iterations=args.iterations,
+        widget_list=args.widget_types,
+        widget_count=args.multi,
+        split_ratio=args.split_ratio,
+        seed=args.seed,
+        workers=args.workers,
+        coco=args.coco,
+        metrics_file=args.metrics
+    )
@@ -0,0 +1,69 @@
+# dataset_stats.py
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import yaml
+
+from util import annotation_index
+
+def read_class_names(dataset_folder: str) -> list:
+    """
+    Class names of a dataset by class id, read from its yaml file
+    """
+    yaml_files = glob.glob(os.path.join(dataset_folder, '*.yaml'))
+    if not yaml_files:
+        print(f"No dataset yaml file in {dataset_folder}")
+        sys.exit(1)
+    with open(yaml_files[0], 'r') as f:
+        names = yaml.safe_load(f)['names']
+    return [names[class_id] for class_id in sorted(names)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print class counts, box sizes and invalid annotations of a dataset using its annotation index.')
+    parser.add_argument('dataset_folder', help='Folder of the dataset (containing the dataset yaml file)')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the annotation index from the manifest and label files first')
+    parser.add_argument('--validate', action='store_true', help='Exit with status 1 if any annotation is invalid')
+    parser.add_argument('--bins', type=int, default=10, help='Number of bins of the box size histogram')
+    parser.add_argument('--json', default=None, help='Write the stats as JSON into this file')
+    args = parser.parse_args()
+
+    class_names = read_class_names(args.dataset_folder)
+    meta = annotation_index.read_meta(annotation_index.index_folder(args.dataset_folder))
+    if args.rebuild or meta is None:
+        start = time.perf_counter()
+        count = annotation_index.build_index(args.dataset_folder, meta['splits'] if meta is not None else ['train', 'val', 'test'])
+        print(f"Indexed {count} images in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    index = annotation_index.load_index(args.dataset_folder)
+    counts = annotation_index.class_counts(index, len(class_names))
+    histogram, edges = annotation_index.box_size_histogram(index, args.bins)
+    issues = annotation_index.validate(index, len(class_names))
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(index['split'])} images, {len(index['class_id'])} boxes ({elapsed * 1000:.1f}ms)")
+    print(f"{'class':<16}" + ''.join(f"{split:>10}" for split in index['splits']))
+    for class_id, class_name in enumerate(class_names):
+        print(f"{class_name:<16}" + ''.join(f"{int(counts[split][class_id]):>10}" for split in index['splits']))
+    print("Box size (square root of the area in pixels):")
+    for count, low, high in zip(histogram, edges[:-1], edges[1:]):
+        print(f"  {low:>8.1f} - {high:<8.1f} {int(count):>10}")
+    for issue, image_ids in issues.items():
+        if len(image_ids):
+            examples = ', '.join(index['image_paths'][image_id] for image_id in image_ids[:3])
+            print(f"{issue}: {len(image_ids)} images (e.g. {examples})")
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'images': len(index['split']),
+                'boxes': len(index['class_id']),
+                'class_counts': {split: dict(zip(class_names, counts[split].tolist())) for split in index['splits']},
+                'box_sizes': {'counts': histogram.tolist(), 'edges': edges.tolist()},
+                'issues': {issue: [index['image_paths'][image_id] for image_id in image_ids] for issue, image_ids in issues.items()},
+            }, f, indent=4)
+    if args.validate and any(len(image_ids) for image_ids in issues.values()):
+        sys.exit(1)
@@ -0,0 +1,116 @@
+# multi_node.py
+import os
+import sys
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import ui_randomizer
+from util import distributed
+
+def plan(plan_file: str, parts: int, seed: int, argv: list) -> None:
+    """
+    Split a job, given by the command line arguments of the randomizer, into parts with disjoint index ranges and their own seeds
+    """
+    args = ui_randomizer.create_argument_parser().parse_args(argv)
+    output_folder = os.path.abspath(args.output_folder)
+    part_plans = distributed.plan_parts(args.iterations, parts, seed)
+    distributed.write_plan(plan_file, argv, output_folder, 'custom', part_plans, seed, args.iterations)
+    for part in part_plans:
+        print(f"Part {part['part']}: {part['iterations']} iterations starting at {part['start']} with seed {part['seed']}")
+
+def run_part(plan_file: str, part: int) -> None:
+    """
+    Run a single part of a planned job on this node
+
+    The splits of all iterations are drawn once from the seed of the job and every part takes its slice,
+    so the merged dataset has the split ratio of the job. The seed of the part is used for the remaining randomness.
+    """
+    job = distributed.read_plan(plan_file)
+    part_plan = job['parts'][part]
+    args = ui_randomizer.create_argument_parser().parse_args(job['argv'])
+    splits = None
+    if job.get('iterations') is not None:
+        if args.split_ratio is None:
+            job_splits = ui_randomizer.assign_splits(job['iterations'], seed=job['seed'])
+        else:
+            job_splits = ui_randomizer.assign_splits(job['iterations'], args.split_ratio, job['seed'])
+        splits = job_splits[part_plan['start']:part_plan['start'] + part_plan['iterations']]
+    args.iterations = part_plan['iterations']
+    args.seed = part_plan['seed']
+    args.output_folder = distributed.part_folder(job['output_folder'], part)
+    ui_randomizer.run(args, start_index=part_plan['start'], splits=splits)
+
+def merge(plan_file: str) -> None:
+    """
+    Merge the datasets of all parts of a planned job into one dataset yaml, data file and list files
+    """
+    job = distributed.read_plan(plan_file)
+    args = ui_randomizer.create_argument_parser().parse_args(job['argv'])
+    dataset_folder = os.path.join(job['output_folder'], job['dataset_name'])
+    part_folders = [distributed.part_folder(job['output_folder'], part['part']) for part in job['parts']]
+    sources = distributed.merge_parts(job['output_folder'], job['dataset_name'], part_folders, ui_randomizer.dataset_splits)
+    split_sources = []
+    for split in ui_randomizer.dataset_splits:
+        images, tar_shards = sources[split]
+        if tar_shards:
+            split_sources.append(tar_shards)
+        else:
+            ui_randomizer.create_dataset_list_file(images, os.path.join(dataset_folder, f"{split}.txt"), root=dataset_folder)
+            split_sources.append(f"{split}.txt")
+    widget_list = [widget for widget, _ in args.targets] if args.targets is not None else args.widget_types
+    class_names = [ui_randomizer.classes[widget]['name'] for widget in widget_list]
+    ui_randomizer.create_dataset_yaml_file(dataset_folder, job['dataset_name'], class_names, *split_sources)
+    names_file = os.path.join(dataset_folder, 'classes.names')
+    with open(names_file, 'w') as f:
+        f.writelines(class_name + '\n' for class_name in class_names)
+    if not any(isinstance(split_source, list) for split_source in split_sources):
+        ui_randomizer.create_data_file(dataset_folder, len(class_names), os.path.join(dataset_folder, 'train.txt'), os.path.join(dataset_folder, 'val.txt'), names_file,
+                                       root=dataset_folder)
+
+def run_local(plan_file: str, parallel: int) -> None:
+    """
+    Run all parts of a planned job as separate local processes and merge them afterwards
+    """
+    job = distributed.read_plan(plan_file)
+
+    def run_process(part: dict) -> int:
+        return subprocess.run([sys.executable, os.path.abspath(__file__), 'run', plan_file, str(part['part'])]).returncode
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return_codes = list(executor.map(run_process, job['parts']))
+    failed = [part['part'] for part, return_code in zip(job['parts'], return_codes) if return_code != 0]
+    if failed:
+        print(f"Parts {', '.join(str(part) for part in failed)} failed, not merging")
+        sys.exit(1)
+    merge(plan_file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plan, run and merge a dataset generation job split across multiple nodes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    plan_parser = subparsers.add_parser('plan', help='Split a job into parts, the randomizer arguments follow after --')
+    plan_parser.add_argument('plan_file', help='Path of the plan file to write')
+    plan_parser.add_argument('-n', '--parts', type=int, required=True, help='Number of parts (shards) to split the job into')
+    plan_parser.add_argument('--seed', type=int, default=0, help='Seed of the job, the seeds of the parts are derived from it')
+    plan_parser.add_argument('argv', nargs=argparse.REMAINDER, help='Arguments of the randomizer')
+    run_parser = subparsers.add_parser('run', help='Run a single part of a job on this node')
+    run_parser.add_argument('plan_file', help='Path of the plan file')
+    run_parser.add_argument('part', type=int, help='Number of the part to run')
+    merge_parser = subparsers.add_parser('merge', help='Merge the outputs of all parts of a job')
+    merge_parser.add_argument('plan_file', help='Path of the plan file')
+    local_parser = subparsers.add_parser('local', help='Run all parts of a job as local processes and merge them')
+    local_parser.add_argument('plan_file', help='Path of the plan file')
+    local_parser.add_argument('-j', '--parallel', type=int, default=2, help='Number of parts to run at once')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    if args.command == 'plan':
+        plan(args.plan_file, args.parts, args.seed, [arg for arg in args.argv if arg != '--'])
+    elif args.command == 'run':
+        run_part(args.plan_file, args.part)
+    elif args.command == 'merge':
+        merge(args.plan_file)
+    elif args.command == 'local':
+        run_local(args.plan_file, args.parallel)
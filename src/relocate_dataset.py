@@ -0,0 +1,33 @@
+# relocate_dataset.py
+import os
+import sys
+import time
+import argparse
+import logging
+
+from util import relocate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Point a moved dataset at its new root and rewrite absolute paths of older list files.')
+    parser.add_argument('dataset_folder', help='Folder of the dataset (containing the dataset yaml file)')
+    parser.add_argument('--root', default=None, help='New root of the dataset (default: the current location of the dataset folder)')
+    parser.add_argument('--old_root', default=None, help='Previous root of a dataset with absolute paths in its list and data files, which are rewritten to the new root')
+    parser.add_argument('--files', nargs='+', default=None, help='Further list files with absolute paths below the previous root')
+    parser.add_argument('--chunk_size', type=int, default=64, metavar='SIZE_MB', help='Size of the chunks list files are rewritten in')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    if not os.path.isdir(args.dataset_folder):
+        print(f"{args.dataset_folder} is not a directory")
+        sys.exit(1)
+    if args.files is not None and args.old_root is None:
+        print("--files requires --old_root")
+        sys.exit(1)
+    start = time.perf_counter()
+    result = relocate.relocate_dataset(args.dataset_folder, args.root, args.old_root, args.files, args.chunk_size << 20)
+    for path in result['rewritten']:
+        print(f"Rewrote {path}")
+    for path in result['updated']:
+        print(f"Updated {path}")
+    print(f"Relocated {args.dataset_folder} to {os.path.abspath(args.root or args.dataset_folder)} ({(time.perf_counter() - start) * 1000:.1f}ms)")
@@ -0,0 +1,57 @@
+# run_matrix.py
+import os
+import sys
+import argparse
+import logging
+
+import ui_randomizer
+from util import matrix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render a whole matrix of jobs declared in a YAML file with a single worker pool.')
+    parser.add_argument('config', help='Path to the YAML file of the run matrix')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of generator processes to run in parallel (overrides workers of the matrix)')
+    parser.add_argument('--dry_run', action='store_true', help='Only print the groups of the matrix')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    config = matrix.load_matrix(args.config)
+    groups = matrix.expand_matrix(config)
+    for group in groups:
+        for widget in group['widget_types']:
+            if widget not in ui_randomizer.classes.keys():
+                print(f"Widget type {widget} not supported. Please use one of the following: {', '.join(ui_randomizer.classes.keys())}")
+                sys.exit(1)
+        print(f"{group['dataset']}: {group['iterations']} x {','.join(group['widget_types'])} ({group['widget_count']} widgets, "
+              f"{group['width']}x{group['height']}, layout {group['layout'] or 'none'}, delay {group['delay_count']})")
+    if args.dry_run:
+        sys.exit(0)
+
+    # Relative paths of the matrix are relative to the folder of the YAML file
+    config_folder = os.path.dirname(os.path.abspath(args.config))
+    split_ratio = config.get('split_ratio')
+    if isinstance(split_ratio, list):
+        split_ratio = ','.join(str(x) for x in split_ratio)
+    ui_randomizer.capture_matrix(
+        app=os.path.join(config_folder, config['app_path']),
+        output_folder=os.path.join(config_folder, config['output_folder']),
+        groups=groups,
+        workers=args.workers if args.workers is not None else config.get('workers', 1),
+        watch_output=config.get('watch', False),
+        timeout=config.get('timeout'),
+        retries=config.get('retries', 0),
+        split_ratio=ui_randomizer.parse_split_ratio(str(split_ratio)) if split_ratio is not None else None,
+        seed=config.get('seed'),
+        coco=config.get('coco', False),
+        shard_size=config['shards'] << 20 if config.get('shards') is not None else None,
+        metrics_file=os.path.join(config_folder, config['metrics']) if config.get('metrics') is not None else None,
+        progress=config.get('progress', False),
+        dedup_threshold=config.get('dedup'),
+        dedup_rerenders=config.get('dedup_rerenders', 0),
+        cache_folder=os.path.join(config_folder, config['cache']) if config.get('cache') is not None else None,
+        cache_size=int(config.get('cache_size', 10) * (1 << 30)),
+        staging_folder=os.path.join(config_folder, config['staging']) if config.get('staging') is not None else None,
+        staging_batch=config.get('staging_batch', 1000),
+        staging_size=config.get('staging_size', 1024) << 20
+    )
@@ -1,35 +1,68 @@
 # ui_capture.py
 import subprocess
 import os
+import sys
 import argparse
 import shutil
+import glob
 import random
+import json
+import queue
+import logging
+import itertools
+import functools
+import tempfile
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
 
 from typing import List
 from typing import Tuple
+from typing import Callable
+from typing import Iterable
 
-from util import replace
-from util import generators
-from util import normalize
 from util import yolo_to_coco
+from util import watch
+from util import labels
+from util import pipeline
+from util import manifest
+from util import shards
+from util import relocate
+from util import metrics
+from util import dedup
+from util import planner
+from util import cache as render_cache
+from util import augment
+from util import matrix
+from util import compositor
+from util import annotation_index
+from util import distributed
 
 default_widget_list = ['button', 'checkbox', 'label', 'slider', 'switch', 'progressbar']
 # Some constants
 old = 0
 new = 1
+# Widgets without text stay valid when mirrored ("flip"), mirrored text isn't a valid UI
 classes = {
-    "button": {"name": "lv_btn", "index": 0},
-    "checkbox": {"name": "lv_checkbox", "index": 1},
-    "label": {"name": "lv_label", "index": 2},
-    "slider": {"name": "lv_slider", "index": 3},
-    "switch": {"name": "lv_switch", "index": 4},
-    "progressbar": {"name": "lv_bar", "index": 5},
+    "button": {"name": "lv_btn", "index": 0, "flip": False},
+    "checkbox": {"name": "lv_checkbox", "index": 1, "flip": False},
+    "label": {"name": "lv_label", "index": 2, "flip": False},
+    "slider": {"name": "lv_slider", "index": 3, "flip": True},
+    "switch": {"name": "lv_switch", "index": 4, "flip": True},
+    "progressbar": {"name": "lv_bar", "index": 5, "flip": True},
 }
+dataset_splits = ['train', 'val', 'test']
+# Prefix of the subfolders staged batches are published as in the image and label folders of a split
+BATCH_PREFIX = 'batch_'
+# Dictionary in the format: {class_name: widget}
+widget_names = {value['name']: widget for widget, value in classes.items()}
 
 def run_ui_generator(app: str, out_dir: str, 
                      width: int, height: int, widget_list: int, widget_count: int, output_file: int, delay_count: int, 
-                     layout: str = None) -> None:
+                     layout: str = None, watch_output: bool = False, timeout: float = None, retries: int = 0,
+                     cache: dict = None, seed: int = None, rerender: int = 0) -> bool:
     """
     Run the random UI generator binary with the provided parameters
 
@@ -42,11 +75,49 @@ def run_ui_generator(app: str, out_dir: str,
     output_file: path to the output file
     delay_count: amount of times the timer handler shall be called with a fixed delay before capturing the UI (amount is multiplied by 1000ms in the binary)
     layout: layout to be used in the UI (none, grid, flex)
+    watch_output: end the binary as soon as the image and label files are complete instead of waiting for it to exit
+    timeout: hard timeout in seconds for a single render
+    retries: amount of times a failed or timed out render is repeated
+    cache: render cache (see util.cache) to serve the render from or add it to
+    seed: number of the render, part of its cache key together with rerender (the attempt after rejected renders)
+
+    Returns True if the image and label file were created
     """
-    if layout is None:
-        subprocess.run(executable=app, cwd=out_dir, args=[app, '-w', str(width), '-h', str(height), '-c', str(widget_count), '-t', ','.join(widget_list), '-o', output_file, '-d', str(delay_count), '-l', 'none'])
-    else:
-        subprocess.run(executable=app, cwd=out_dir, args=[app, '-w', str(width), '-h', str(height), '-c', str(widget_count), '-t', ','.join(widget_list), '-o', output_file, '-d', str(delay_count), '-l', str(layout)])
+    args = [app, '-w', str(width), '-h', str(height), '-c', str(widget_count), '-t', ','.join(widget_list), '-o', output_file, '-d', str(delay_count), '-l', 'none' if layout is None else str(layout)]
+    output_image_path = os.path.join(out_dir, output_file.lstrip('/'))
+    output_files = [output_image_path, output_image_path.replace('.jpg', '.txt')]
+    if cache is not None:
+        key = render_cache.render_key(cache, app, width, height, widget_list, widget_count, delay_count, layout, seed, rerender)
+        if render_cache.lookup(cache, key, output_image_path):
+            return True
+    for attempt in range(retries + 1):
+        if watch_output:
+            completed = watch.run_until_files_complete(args, out_dir, output_files, timeout)
+        else:
+            with metrics.timed('spawn'):
+                process = subprocess.Popen(executable=app, cwd=out_dir, args=args)
+            try:
+                with metrics.timed('wait'):
+                    process.wait(timeout)
+                with metrics.timed('capture'):
+                    completed = watch.files_complete(output_files)
+            except subprocess.TimeoutExpired:
+                logging.warning("Process %s timed out after %.2fs", app, timeout)
+                metrics.increment('timeouts')
+                watch.stop_process(process)
+                completed = False
+        if completed:
+            metrics.increment('renders')
+            if cache is not None:
+                render_cache.store(cache, key, output_image_path)
+            return True
+        metrics.increment('failed_attempts')
+        logging.warning("Render of %s failed (attempt %i of %i)", output_file, attempt + 1, retries + 1)
+        for file in output_files:
+            if os.path.exists(file):
+                os.remove(file)
+    metrics.increment('failed_renders')
+    return False
 
 def create_dataset(root: str, images: List[str], labels: List[str], output_folder: str) -> None:
     os.makedirs(output_folder, exist_ok=True)
@@ -58,26 +129,45 @@ def create_dataset(root: str, images: List[str], labels: List[str], output_folde
     #     output_folder = output_folder.replace(replace[old], replace[new])
     # replace.replace_paths_in_dataset_files(output_folder, replace)
 
-def create_data_file(data_folder, num_classes, train_file, val_file, names_file):
-    data_file_path = os.path.join(data_folder, 'custom.data')
+def create_data_file(data_folder, num_classes, train_file, val_file, names_file, root: str = None):
+    """
+    Create the darknet data file of a dataset
+
+    With a root, the paths are written relative to it together with a root entry, so relocating the dataset only changes that entry (see util.relocate)
+    """
+    data_file_path = os.path.join(data_folder, relocate.DATA_FILE)
+    if root is not None:
+        train_file, val_file, names_file = (relocate.root_relative_path(path, root) for path in (train_file, val_file, names_file))
     with open(data_file_path, 'w') as file:
         file.write(f"classes={num_classes}\n")
         file.write(f"train={train_file}\n")
         file.write(f"valid={val_file}\n")
         file.write(f"names={names_file}\n")
+        if root is not None:
+            file.write(f"root={os.path.abspath(root)}\n")
     return data_file_path
 
-def create_dataset_list_file(file_paths, output_file, replace: tuple = None):
+def create_dataset_list_file(file_paths, output_file, replace: tuple = None, root: str = None):
+    """
+    Write the paths of the images of a split into a list file
+
+    replace: tuple of (old, new) path prefix to be replaced in every path
+    root: write the paths relative to the root of the dataset (e.g. ./images/train/ui_button_0.jpg), so the list file stays valid when the dataset is moved
+    """
     with open(output_file, 'w') as file:
         for path in file_paths:
             if replace is not None:
                 path = path.replace(replace[old], replace[new])
+            if root is not None:
+                path = relocate.root_relative_path(path, root)
             file.write(path + '\n')
 
 def create_dataset_yaml_file(output_folder: str, name: str, classes: str, train_dir: str, val_dir: str, test_dir: str = None) -> dict:
     """
     Create a yaml file for the dataset using the provided name, classes and directories
 
+    Directories may also be lists of paths (e.g. the shard files of a split)
+
     Example dataset.yaml file:
     # Train/val/test sets as 1) dir: path/to/imgs, 2) file: path/to/imgs.txt, or 3) list: [path/to/imgs1, path/to/imgs2, ..]
     path: ../datasets/coco8  # dataset root dir
@@ -105,7 +195,7 @@ def create_dataset_yaml_file(output_folder: str, name: str, classes: str, train_
         'test': test_dir,
         'names': classes_dict
     }
-    with open(os.path.join(output_folder, f"{name}.yaml"), 'w') as file:
+    with metrics.timed('yaml'), open(os.path.join(output_folder, f"{name}.yaml"), 'w') as file:
         yaml.dump(dataset_yaml, file)
     return classes_dict
 
@@ -117,9 +207,51 @@ def move_image_file_with_label(image_path: str, image_output_dir: str, label_out
     shutil.move(label_path, os.path.join(label_output_dir, os.path.basename(label_path)))
     return new_image_path
 
-def shuffle_image_files(image_files: List[str], split_ratio: tuple = (0.7, 0.1, 0.2)) -> Tuple[List[str], List[str], List[str]]:
+def place_sample(image_path: str, image_output_dir: str, label_output_dir: str, class_ids: dict, width: int, height: int) -> str:
+    """
+    Move a rendered image into the dataset and write its fixed label file next to it
+
+    The raw label file is read once, written with class ids and normalized bounding boxes into label_output_dir and removed afterwards.
+    Images rendered directly into image_output_dir aren't moved at all.
+
+    Returns the new image path
+    """
+    new_image_path = os.path.join(image_output_dir, os.path.basename(image_path))
+    if os.path.abspath(image_path) != os.path.abspath(new_image_path):
+        with metrics.timed('move'):
+            shutil.move(image_path, new_image_path)
+    label_path = image_path.replace('.jpg', '.txt')
+    with metrics.timed('labels'):
+        labels.fix_label_file(label_path, class_ids, width, height, os.path.join(label_output_dir, os.path.basename(label_path)))
+        os.remove(label_path)
+    metrics.increment('samples')
+    return new_image_path
+
+def pack_sample(image_path: str, writer: dict, class_ids: dict, width: int, height: int, record: dict) -> List[dict]:
+    """
+    Pack a rendered image, its fixed label and its record into the current shard of a shard writer
+
+    The rendered image and raw label file are removed afterwards
+
+    Returns the records of the samples in a shard completed by this call
+    """
+    label_path = image_path.replace('.jpg', '.txt')
+    key = os.path.splitext(os.path.basename(image_path))[0]
+    with metrics.timed('labels'):
+        label = labels.read_fixed_label(label_path, class_ids, width, height)
+    record = dict(record, image=f"{key}.jpg", label=f"{key}.txt")
+    with metrics.timed('shard'):
+        with open(image_path, 'rb') as f:
+            image = f.read()
+        completed = shards.write_sample(writer, key, {'jpg': image, 'txt': label.encode(), 'json': json.dumps(record).encode()}, record)
+        os.remove(image_path)
+        os.remove(label_path)
+    metrics.increment('samples')
+    return completed
+
+def shuffle_image_files(image_files: List[str], split_ratio: tuple = (0.7, 0.1, 0.2), seed: int = None) -> Tuple[List[str], List[str], List[str]]:
     # Assume split_ratio is a tuple of three numbers (train, val, test) that sums to 1
-    random.shuffle(image_files)
+    random.Random(seed).shuffle(image_files)
     num_train = int(len(image_files) * split_ratio[0])
     num_val = int(len(image_files) * split_ratio[1])
 
@@ -129,80 +261,821 @@ def shuffle_image_files(image_files: List[str], split_ratio: tuple = (0.7, 0.1,
 
     return (train_images, val_images, test_images)
 
-def dataset_generation(output_folder: str, name: str, images: List[str], width: int, height: int, class_names: List[str], split_ratio: tuple = None):
+def assign_splits(count: int, split_ratio: tuple = (0.7, 0.1, 0.2), seed: int = None) -> List[str]:
+    """
+    Assign a dataset split to each of count samples before they are rendered
+
+    Uses the same proportions as shuffle_image_files(), the assignment is reproducible if a seed is provided
+
+    Returns a shuffled list of split names (train, val, test)
+    """
+    num_train = int(count * split_ratio[0])
+    num_val = int(count * split_ratio[1])
+    splits = ['train'] * num_train + ['val'] * num_val + ['test'] * (count - num_train - num_val)
+    random.Random(seed).shuffle(splits)
+    return splits
+
+def assign_job_splits(jobs: List[dict], split_ratio: tuple = None, seed: int = None) -> None:
+    """
+    Assign a split to every job without one using assign_splits()
+    """
+    unassigned = [job for job in jobs if 'split' not in job]
+    if split_ratio is None:
+        splits = assign_splits(len(unassigned), seed=seed)
+    else:
+        splits = assign_splits(len(unassigned), split_ratio, seed)
+    for job, split in zip(unassigned, splits):
+        job['split'] = split
+
+def parse_class_target(value: str) -> Tuple[str, int]:
+    """
+    Parse an instance target of a widget type from the command line (e.g. button=500)
+    """
+    widget, _, amount = value.partition('=')
+    if widget not in classes or not amount.isdigit():
+        raise argparse.ArgumentTypeError(f"Invalid target {value}, expected <widget>=<instances> with one of the widgets: {', '.join(classes.keys())}")
+    return widget, int(amount)
+
+def parse_split_ratio(value: str) -> tuple:
+    """
+    Parse a split ratio for train, val and test from the command line
+
+    Accepts three comma separated numbers (e.g. 0.7,0.1,0.2 or 70,10,20), which are scaled to sum up to 1
+    """
+    try:
+        ratio = tuple(float(x) for x in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid split ratio {value}, expected three comma separated numbers")
+    if len(ratio) != 3 or any(x < 0 for x in ratio) or sum(ratio) <= 0:
+        raise argparse.ArgumentTypeError(f"Invalid split ratio {value}, expected three comma separated non-negative numbers")
+    return tuple(x / sum(ratio) for x in ratio)
+
+def parse_image_size(value: str) -> Tuple[int, int]:
+    """
+    Parse an image size from the command line (e.g. 320x240)
+    """
+    try:
+        return matrix.parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def flip_class_ids(class_names: List[str]) -> List[str]:
+    """
+    Class ids of the widgets which stay valid when mirrored
+    """
+    return [str(i) for i, class_name in enumerate(class_names) if classes[widget_names[class_name]]['flip']]
+
+def augment_samples(samples: List[Tuple[str, str]], augmentation: dict, class_names: List[str], workers: int = None) -> List[Tuple[str, str, str, Tuple[int, int]]]:
+    """
+    Write augmented copies of placed samples next to them, see util.augment
+
+    Returns a list of (source image path, image path, label path, size) of the augmented samples
+    """
+    return augment.augment_samples(samples, dict(augmentation, flip_class_ids=flip_class_ids(class_names)), workers)
+
+def create_dataset_folders(output_folder: str, name: str) -> dict:
+    """
+    Create the folder structure of a dataset
+
+    Returns a dictionary in the format: {split: (image_folder, label_folder)}
+    """
+    target_dir = os.path.join(output_folder, name)
+    split_folders = {}
+    for split in dataset_splits:
+        split_folders[split] = (os.path.join(target_dir, 'images', split), os.path.join(target_dir, 'labels', split))
+        for folder in split_folders[split]:
+            os.makedirs(folder, exist_ok=True)
+    return split_folders
+
+def dataset_generation(output_folder: str, name: str, images: List[str], width: int, height: int, class_names: List[str], split_ratio: tuple = None, seed: int = None,
+                       augmentation: dict = None, workers: int = None):
     """
     Generate a dataset from a list of images
+
+    augmentation: settings of the augmentation stage (see util.augment), every image gets augmented copies in its split
+    workers: number of processes of the augmentation stage (default: number of CPUs)
+
+    The annotation index of the dataset is built while the images are placed.
     """
-    # Some variables
-    train_img_dir = "images/train"
-    train_label_dir = "labels/train"
-    val_img_dir = "images/val"
-    val_label_dir = "labels/val"
-    test_img_dir = "images/test"
-    test_label_dir = "labels/test"
     target_dir = os.path.join(output_folder, name)
-    train_img_folder = os.path.join(target_dir, train_img_dir)
-    train_label_folder = os.path.join(target_dir, train_label_dir)
-    val_img_folder = os.path.join(target_dir, val_img_dir)
-    val_label_folder = os.path.join(target_dir, val_label_dir)
-    test_img_folder = os.path.join(target_dir, test_img_dir)
-    test_label_folder = os.path.join(target_dir, test_label_dir)
-
-    # Create all necessary folders
-    folders = [target_dir, train_img_folder, train_label_folder, val_img_folder, val_label_folder, test_img_folder, test_label_folder]
-    for folder in folders:
-        os.makedirs(folder, exist_ok=True)
+    split_folders = create_dataset_folders(output_folder, name)
 
     # Shuffle images
     if split_ratio is None:
-        train_images, val_images, test_images = shuffle_image_files(images)
+        split_images = shuffle_image_files(images, seed=seed)
     else:
-        train_images, val_images, test_images = shuffle_image_files(images, split_ratio)
-    # FIXME images and labels aren't moved properly!
-    # Move all images and labels to the correct folders
-    for i, image_path in enumerate(train_images):
-        train_images[i] = move_image_file_with_label(image_path, train_img_folder, train_label_folder)
-    for i, image_path in enumerate(val_images):
-        val_images[i] = move_image_file_with_label(image_path, val_img_folder, val_label_folder)
-    for i, image_path in enumerate(test_images):
-        test_images[i] = move_image_file_with_label(image_path, test_img_folder, test_label_folder)
+        split_images = shuffle_image_files(images, split_ratio, seed)
 
     # Dictionary in the format: {class_id: class_name}
-    class_dict = create_dataset_yaml_file(target_dir, name, class_names, train_img_dir, val_img_dir, test_img_dir)
+    class_dict = create_dataset_yaml_file(target_dir, name, class_names, *[f"images/{split}" for split in dataset_splits])
+
+    # Move all images to the correct folders and fix label files to use class_id instead of class_name and normalized bounding boxes
+    class_ids = labels.class_id_map(class_names)
+    index_writer = annotation_index.open_index_writer(target_dir, dataset_splits)
+    try:
+        for split, image_paths in zip(dataset_splits, split_images):
+            label_folder = split_folders[split][1]
+            for i, image_path in enumerate(image_paths):
+                image_paths[i] = place_sample(image_path, *split_folders[split], class_ids, width, height)
+                label_path = os.path.join(label_folder, os.path.basename(image_paths[i]).replace('.jpg', '.txt'))
+                annotation_index.add_label_file(index_writer, target_dir, image_paths[i], label_path, split, width, height)
+            if augmentation is not None:
+                augmented = augment_samples([(image_path, os.path.join(label_folder, os.path.basename(image_path).replace('.jpg', '.txt'))) for image_path in image_paths],
+                                            augmentation, class_names, workers)
+                for _, image_path, label_path, (augmented_width, augmented_height) in augmented:
+                    annotation_index.add_label_file(index_writer, target_dir, image_path, label_path, split, augmented_width, augmented_height)
+    finally:
+        annotation_index.close_index_writer(index_writer)
+
+def create_render_jobs(iterations: int, widget_list: List[str], split_widgets: bool, start: int = 0) -> List[dict]:
+    """
+    Create the ordered list of generator invocations for a run
+
+    Each job is a dictionary with the iteration index, the widgets to render and the output file name of the image.
+    Iterations are numbered starting at start.
+    """
+    jobs = []
+    for i in range(start, start + iterations):
+        if split_widgets:
+            for widget in widget_list:
+                jobs.append({'index': i, 'widgets': [widget], 'output_file': f"ui_{widget}_{i}.jpg"})
+        else:
+            jobs.append({'index': i, 'widgets': widget_list, 'output_file': f"ui_{'-'.join(widget_list)}_{i}.jpg"})
+    return jobs
+
+def run_ui_generator_pool(app: str, output_folder: str, jobs: Iterable[dict],
+                          width: int, height: int, widget_count: int, delay_count: int,
+                          layout: str = None, workers: int = 1,
+                          watch_output: bool = False, timeout: float = None, retries: int = 0,
+                          on_render: Callable[[dict, str], None] = None,
+                          accept: Callable[[dict, str], bool] = None, rerenders: int = 0,
+                          on_drop: Callable[[dict], None] = None, cache: dict = None) -> List[str]:
+    """
+    Run the random UI generator binary for every job using a pool of worker processes
+
+    Jobs may be a lazy iterable, the next job is only taken once a worker is available.
+    Jobs may override the size, widget count, delay count and layout of the run (job['width'], job['height'], job['widget_count'], job['delay_count'], job['layout']).
+    Images and labels are written into the folder of the job (job['folder']) or the output folder if the job has none.
+    Every worker renders inside its own scratch folder below the scratch folder of the job (job['scratch_folder'], defaults to the folder of the job),
+    so files of concurrent renders can't collide. The scratch folder has to be on the same file system as the folder of the job.
+    Finished images and labels are renamed into the folder afterwards.
+    accept is called with the job and the image path of every finished render, rejected renders are removed
+    and rendered again up to rerenders times before the job is dropped.
+    on_render is called with the job and the image path as soon as a render is finished and accepted,
+    on_drop is called with the job if it failed, was dropped or on_render raised.
+    Renders are served from and added to the render cache if one is provided.
+    At most twice as many jobs as workers are in flight at any time.
+
+    Returns the image paths in the order of the provided jobs, failed and dropped renders are left out
+    """
+    def render_job(job: dict, render_folder: str) -> str:
+        folder = job.get('folder', output_folder)
+        output_image_path = os.path.join(folder, job['output_file'])
+        output_files = (output_image_path, output_image_path.replace('.jpg', '.txt'))
+        for attempt in range(rerenders + 1):
+            if not run_ui_generator(app, render_folder, job.get('width', width), job.get('height', height), job['widgets'], job.get('widget_count', widget_count),
+                                    f"/{job['output_file']}", job.get('delay_count', delay_count),
+                                    job.get('layout', layout), watch_output, timeout, retries, cache, job['index'], attempt):
+                logging.error("Skipping %s, render failed", job['output_file'])
+                return None
+            if render_folder != folder:
+                render_image_path = os.path.join(render_folder, job['output_file'])
+                with metrics.timed('rename'):
+                    for render_path, output_path in zip((render_image_path, render_image_path.replace('.jpg', '.txt')), output_files):
+                        if os.path.exists(render_path):
+                            os.replace(render_path, output_path)
+            if accept is None or accept(job, output_image_path):
+                return output_image_path
+            for output_path in output_files:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+        logging.info("Dropping %s, rejected after %i renders", job['output_file'], rerenders + 1)
+        return None
+
+    if workers <= 1:
+        image_paths = []
+        for job in jobs:
+            image_path = render_job(job, job.get('folder', output_folder))
+            if image_path is not None:
+                image_paths.append(image_path)
+                if on_render is not None:
+                    try:
+                        on_render(job, image_path)
+                    except Exception:
+                        if on_drop is not None:
+                            on_drop(job)
+                        raise
+            elif on_drop is not None:
+                on_drop(job)
+        return image_paths
+
+    worker_ids = queue.Queue()
+    for n in range(workers):
+        worker_ids.put(n)
+    scratch_folders = set()
+    image_paths = {}
+
+    def render(index: int, job: dict) -> None:
+        worker_id = worker_ids.get()
+        try:
+            scratch_folder = os.path.join(job.get('scratch_folder', job.get('folder', output_folder)), f".worker_{worker_id}")
+            scratch_folders.add(scratch_folder)
+            os.makedirs(scratch_folder, exist_ok=True)
+            image_paths[index] = render_job(job, scratch_folder)
+        finally:
+            worker_ids.put(worker_id)
+        if image_paths[index] is not None and on_render is not None:
+            try:
+                on_render(job, image_paths[index])
+            except Exception:
+                if on_drop is not None:
+                    on_drop(job)
+                raise
+        elif image_paths[index] is None and on_drop is not None:
+            on_drop(job)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for index, job in enumerate(jobs):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(render, index, job))
+            for future in pending:
+                future.result()
+    finally:
+        for scratch_folder in scratch_folders:
+            shutil.rmtree(scratch_folder, ignore_errors=True)
+    return [image_paths[index] for index in sorted(image_paths) if image_paths[index] is not None]
+
+def export_coco(dataset_folder: str, class_names: List[str]) -> None:
+    """
+    Export COCO annotation files for every split into the annotations folder of a dataset, read from its annotation index
+    """
+    index = annotation_index.load_index(dataset_folder)
+    os.makedirs(os.path.join(dataset_folder, 'annotations'), exist_ok=True)
+    for split in dataset_splits:
+        with metrics.timed('coco'):
+            yolo_to_coco.write_coco_streaming(os.path.join(dataset_folder, 'annotations', f"instances_{split}.json"),
+                                              annotation_index.coco_samples(index, split, len(class_names)), class_names)
+
+def remove_unrecorded_batch_files(dataset_folder: str, split_folders: dict) -> int:
+    """
+    Remove the files of published batches (see open_capture()) which aren't recorded in the manifest of a dataset
 
-    # Fix label files to use class_id instead of class_name
-    for label_file in generators.annotation_files_in_dirs([train_label_folder, val_label_folder, test_label_folder]):
-        replace.replace_class_names_with_id_in_file(class_names, label_file)
-        normalize.normalize_bbox_in_label_file(label_file, width, height)
+    A crash between publishing a batch and recording its samples leaves such files behind, their samples are rendered again on resume
+
+    Returns the amount of removed files
+    """
+    recorded = set()
+    for record in manifest.read_manifest(manifest.manifest_path(dataset_folder)):
+        recorded.update((record['image'], record['label']))
+    removed = 0
+    for folder in itertools.chain.from_iterable(split_folders.values()):
+        for batch_folder in glob.glob(os.path.join(folder, BATCH_PREFIX + '*')):
+            for entry in os.scandir(batch_folder):
+                if os.path.relpath(entry.path, dataset_folder) not in recorded:
+                    os.remove(entry.path)
+                    removed += 1
+            if not os.listdir(batch_folder):
+                os.rmdir(batch_folder)
+    if removed:
+        logging.warning("Removed %i files of batches which weren't recorded in the manifest", removed)
+    return removed
+
+def open_capture(output_folder: str, dataset_name: str, jobs: Iterable[dict], widget_list: List[str],
+                 width: int, height: int, widget_count: int, delay_count: int, layout: str = None,
+                 split_ratio: tuple = None, seed: int = None, shard_size: int = None, dedup_threshold: int = None,
+                 class_planner: dict = None, resume: bool = False, append: bool = False, augmentation: dict = None,
+                 staging_folder: str = None, staging_batch: int = 1000, staging_size: int = 1 << 30) -> dict:
+    """
+    Prepare a dataset, so every finished render of its jobs can be placed right away
+
+    Jobs without a split get one assigned up front and are rendered straight into the image folder of their split,
+    jobs of a class planner land in the render folder until their classes are known.
+    Jobs may override the width, height, widget count, delay count and layout of the dataset.
+    The records of placed samples are kept for complete_capture() if augmentation is set.
+    With a staging folder, renders are placed in a mirror of the dataset below it and flushed in batches per split by a background thread.
+    A batch is published as a subfolder of the image and label folder of its split (e.g. images/train/batch_00001000) by a single rename each. See capture_ui() for the remaining parameters.
+
+    Returns the capture as dictionary with the prepared jobs, post_process(job, image_path), accept(job, image_path) (None without dedup)
+    and on_drop(job) and on_failure(job) for jobs failed in post_process (both None without planner),
+    to be finished with close_capture() and complete_capture()
+    """
+    dataset_folder = os.path.join(output_folder, dataset_name)
+    os.makedirs(dataset_folder, exist_ok=True)
+    manifest_file = manifest.manifest_path(dataset_folder)
+    # Get new list of real widget names from the classes dictionary
+    class_names = [classes[widget]['name'] for widget in widget_list]
+    class_ids = labels.class_id_map(class_names)
+
+    # Renders and their post-processing stay in the staging folder until they are flushed into the dataset
+    staging_root = tempfile.mkdtemp(prefix=f"{dataset_name}-", dir=staging_folder) if staging_folder is not None else None
+    stage_dataset_folder = os.path.join(staging_root, dataset_name) if staging_root is not None else dataset_folder
+    render_folder = os.path.join(stage_dataset_folder, '.render')
+    if shard_size is None:
+        split_folders = create_dataset_folders(output_folder, dataset_name)
+        stage_folders = create_dataset_folders(staging_root, dataset_name) if staging_root is not None else split_folders
+        create_dataset_yaml_file(dataset_folder, dataset_name, class_names, *[f"images/{split}" for split in dataset_splits])
+    else:
+        shard_folder = os.path.join(dataset_folder, 'shards')
+        split_folders = stage_folders = {split: (render_folder, None) for split in dataset_splits}
+        writers = {split: shards.open_shard_writer(shard_folder, split, max_size=shard_size, staging_folder=staging_root) for split in dataset_splits}
+    # Worker scratch folders live in the render folder, on the file system of the dataset but outside of its split folders
+    os.makedirs(render_folder, exist_ok=True)
+    if resume or append:
+        # Scratch folders of workers killed in a previous run, also below the split folders where older runs kept them
+        for image_folder, _ in split_folders.values():
+            for scratch_folder in glob.glob(os.path.join(image_folder, '.worker_*')):
+                shutil.rmtree(scratch_folder, ignore_errors=True)
+        for scratch_folder in glob.glob(os.path.join(render_folder, '.worker_*')):
+            shutil.rmtree(scratch_folder, ignore_errors=True)
+    if (resume or append) and shard_size is None:
+        remove_unrecorded_batch_files(dataset_folder, split_folders)
+    if resume and shard_size is None and class_planner is None:
+        # Samples placed right before a crash may be missing in the manifest, remove them as they are rendered again
+        for job in jobs:
+            for image_folder, label_folder in split_folders.values():
+                for path in (os.path.join(image_folder, job['output_file']), os.path.join(image_folder, job['output_file'].replace('.jpg', '.txt')),
+                             os.path.join(label_folder, job['output_file'].replace('.jpg', '.txt'))):
+                    if os.path.exists(path):
+                        os.remove(path)
+    if class_planner is None:
+        assign_job_splits(jobs, split_ratio, seed)
+        for job in jobs:
+            job['folder'] = stage_folders[job['split']][0]
+            job['scratch_folder'] = render_folder
+    else:
+        # Splits are assigned once the classes of a render are known, so all renders land in the render folder first
+        jobs = (dict(job, folder=render_folder, scratch_folder=render_folder) for job in jobs)
+
+    index_writer = annotation_index.open_index_writer(dataset_folder, dataset_splits, append=resume or append) if shard_size is None else None
+    manifest_handle = manifest.open_manifest(manifest_file, append=resume or append)
+    placed = []
+    parameters = {'width': width, 'height': height, 'widget_count': widget_count, 'delay_count': delay_count, 'layout': layout}
+
+    def commit_sample(job: dict, job_parameters: dict, image_path: str, label_path: str, placed_image_path: str = None, placed_label_path: str = None) -> None:
+        # Staged samples are read from the staging folder but recorded with their place in the dataset
+        placed_image_path = placed_image_path or image_path
+        placed_label_path = placed_label_path or label_path
+        record = dict(manifest.sample_record(job, dataset_folder, image_path, label_path, **job_parameters),
+                      image=os.path.relpath(placed_image_path, dataset_folder), label=os.path.relpath(placed_label_path, dataset_folder))
+        manifest.write_record(manifest_handle, record)
+        annotation_index.add_label_file(index_writer, dataset_folder, placed_image_path, label_path, job['split'], job_parameters['width'], job_parameters['height'])
+        if augmentation is not None:
+            placed.append(record)
+
+    staged = {split: {'samples': [], 'size': 0} for split in dataset_splits}
+    flush_stage = None
+    if staging_root is not None and shard_size is None:
+        def flush_batch(batch: List[tuple]) -> None:
+            with metrics.timed('flush'):
+                # Copy the batch sequentially onto the volume of the dataset first, then publish it as one subfolder of its split.
+                # The labels go first, so the images never show up without them.
+                image_folder, label_folder = split_folders[batch[0][0]['split']]
+                batch_name = f"{BATCH_PREFIX}{batch[0][0]['index']:08d}"
+                while os.path.exists(os.path.join(image_folder, batch_name)) or os.path.exists(os.path.join(label_folder, batch_name)):
+                    batch_name += '_'
+                flush_folder = tempfile.mkdtemp(prefix='.flush-', dir=dataset_folder)
+                try:
+                    for kind in ('images', 'labels'):
+                        os.makedirs(os.path.join(flush_folder, kind))
+                    for _, _, image_path, label_path in batch:
+                        shutil.copyfile(image_path, os.path.join(flush_folder, 'images', os.path.basename(image_path)))
+                        shutil.copyfile(label_path, os.path.join(flush_folder, 'labels', os.path.basename(label_path)))
+                    os.replace(os.path.join(flush_folder, 'labels'), os.path.join(label_folder, batch_name))
+                    os.replace(os.path.join(flush_folder, 'images'), os.path.join(image_folder, batch_name))
+                finally:
+                    shutil.rmtree(flush_folder, ignore_errors=True)
+                # Samples of a batch which is published but not recorded yet are removed by --resume
+                for job, job_parameters, image_path, label_path in batch:
+                    commit_sample(job, job_parameters, image_path, label_path,
+                                  os.path.join(image_folder, batch_name, os.path.basename(image_path)), os.path.join(label_folder, batch_name, os.path.basename(label_path)))
+                    os.remove(image_path)
+                    os.remove(label_path)
+            metrics.increment('flushed', len(batch))
+
+        # A single queued batch, so the renders wait while one batch is flushing and the next one is complete
+        flush_stage = pipeline.start_stage(flush_batch, queue_size=1)
+
+    def submit_batch(split: str) -> None:
+        pipeline.submit(flush_stage, staged[split]['samples'])
+        staged[split]['samples'], staged[split]['size'] = [], 0
+
+    def stage_sample(job: dict, job_parameters: dict, image_path: str, label_path: str) -> None:
+        # Batches are collected per split, so every batch is published with a single rename
+        split_batch = staged[job['split']]
+        split_batch['samples'].append((job, job_parameters, image_path, label_path))
+        split_batch['size'] += os.path.getsize(image_path) + os.path.getsize(label_path)
+        if len(split_batch['samples']) >= staging_batch:
+            submit_batch(job['split'])
+        elif sum(split_batch['size'] for split_batch in staged.values()) >= staging_size:
+            for split in dataset_splits:
+                if staged[split]['samples']:
+                    submit_batch(split)
+
+    def post_process(job: dict, image_path: str) -> None:
+        job_parameters = dict(parameters, **{key: job[key] for key in parameters if key in job})
+        if class_planner is not None:
+            class_counts = {}
+            for class_name, count in labels.count_classes(image_path.replace('.jpg', '.txt')).items():
+                class_counts[widget_names.get(class_name, class_name)] = count
+            job = dict(job, split=planner.record_sample(class_planner, job, class_counts))
+            job_parameters['classes'] = class_counts
+        if shard_size is None:
+            image_folder, label_folder = stage_folders[job['split']]
+            new_image_path = place_sample(image_path, image_folder, label_folder, class_ids, job_parameters['width'], job_parameters['height'])
+            label_path = os.path.join(label_folder, os.path.basename(new_image_path).replace('.jpg', '.txt'))
+            if flush_stage is None:
+                commit_sample(job, job_parameters, new_image_path, label_path)
+            else:
+                stage_sample(job, job_parameters, new_image_path, label_path)
+        else:
+            # Records are only written once their shard is complete
+            record = manifest.sample_record(job, dataset_folder, image_path, image_path.replace('.jpg', '.txt'), **job_parameters)
+            for completed_record in pack_sample(image_path, writers[job['split']], class_ids, job_parameters['width'], job_parameters['height'], record):
+                manifest.write_record(manifest_handle, completed_record)
+
+    def on_failure(job: dict) -> None:
+        # The post-processing of the job failed, later renders would be dropped as well
+        planner.stop_planner(class_planner)
+        planner.release_job(class_planner, job)
+
+    accept = None
+    dedup_index = None
+    if dedup_threshold is not None:
+        dedup_index = dedup.load_index(os.path.join(dataset_folder, dedup.INDEX_FILE))
+
+        def accept(job: dict, image_path: str) -> bool:
+            with metrics.timed('dedup'):
+                unique = dedup.is_unique_image(dedup_index, image_path, dedup_threshold)
+            if not unique:
+                metrics.increment('duplicates')
+            return unique
+
+    return {
+        'dataset_name': dataset_name,
+        'dataset_folder': dataset_folder,
+        'render_folder': render_folder,
+        'class_names': class_names,
+        'split_folders': split_folders,
+        'writers': writers if shard_size is not None else None,
+        'manifest': manifest_handle,
+        'index_writer': index_writer,
+        'dedup_index': dedup_index,
+        'staging_root': staging_root,
+        'staged': staged,
+        'flush_stage': flush_stage,
+        'augmentation': augmentation,
+        'placed': placed,
+        'jobs': jobs,
+        'post_process': post_process,
+        'accept': accept,
+        'on_drop': (lambda job: planner.release_job(class_planner, job)) if class_planner is not None else None,
+        'on_failure': on_failure if class_planner is not None else None,
+    }
+
+def close_capture(capture: dict) -> None:
+    """
+    Flush the staged samples, save the dedup index, close the shard writers, the annotation index and the manifest of a capture,
+    also after a failed run
+
+    The staging folder is kept if a flush failed, so its samples can be recovered.
+    """
+    flushed = False
+    try:
+        if capture['flush_stage'] is not None:
+            try:
+                for split_batch in capture['staged'].values():
+                    if split_batch['samples']:
+                        pipeline.submit(capture['flush_stage'], split_batch['samples'])
+                        split_batch['samples'] = []
+            finally:
+                pipeline.finish(capture['flush_stage'])
+        flushed = True
+    finally:
+        if capture['dedup_index'] is not None:
+            dedup.save_index(capture['dedup_index'])
+        if capture['writers'] is not None:
+            for writer in capture['writers'].values():
+                for completed_record in shards.close_shard_writer(writer):
+                    manifest.write_record(capture['manifest'], completed_record)
+        if capture['index_writer'] is not None:
+            annotation_index.close_index_writer(capture['index_writer'])
+        capture['manifest'].close()
+        if capture['staging_root'] is not None:
+            if flushed:
+                shutil.rmtree(capture['staging_root'], ignore_errors=True)
+            else:
+                logging.error("Flushing failed, keeping the staged samples in %s", capture['staging_root'])
+
+def close_captures(captures: List[dict]) -> None:
+    """
+    Close all captures, see close_capture(), the first error is raised after every capture has been closed
+    """
+    error = None
+    for capture in captures:
+        try:
+            close_capture(capture)
+        except Exception as e:
+            logging.error("Closing the capture of %s failed: %s", capture['dataset_folder'], e)
+            error = error or e
+    if error is not None:
+        raise error
+
+def complete_capture(capture: dict, coco: bool = False, workers: int = None) -> None:
+    """
+    Remove the render folder of a finished capture, augment its samples and write the dataset yaml of sharded datasets and the COCO annotation files
+
+    workers: number of processes of the augmentation stage
+    """
+    dataset_folder = capture['dataset_folder']
+    shutil.rmtree(capture['render_folder'], ignore_errors=True)
+    if capture['augmentation'] is not None and capture['writers'] is not None:
+        logging.warning("Augmentation isn't supported for sharded datasets")
+    elif capture['augmentation'] is not None:
+        records = {os.path.join(dataset_folder, record['image']): record for record in capture['placed']}
+        augmented = augment_samples([(image_path, os.path.join(dataset_folder, record['label'])) for image_path, record in records.items()],
+                                    capture['augmentation'], capture['class_names'], workers)
+        index_writer = annotation_index.open_index_writer(dataset_folder, dataset_splits, append=True)
+        try:
+            with manifest.open_manifest(manifest.manifest_path(dataset_folder), append=True) as manifest_handle:
+                for source_image_path, image_path, label_path, (width, height) in augmented:
+                    source = records[source_image_path]
+                    manifest.write_record(manifest_handle, dict(source, output_file=os.path.basename(image_path), augmented_from=source['output_file'],
+                                                                image=os.path.relpath(image_path, dataset_folder), label=os.path.relpath(label_path, dataset_folder),
+                                                                sha256=manifest.file_checksum(image_path), width=width, height=height))
+                    annotation_index.add_label_file(index_writer, dataset_folder, image_path, label_path, source['split'], width, height)
+        finally:
+            annotation_index.close_index_writer(index_writer)
+    if capture['writers'] is not None:
+        shard_folder = os.path.join(dataset_folder, 'shards')
+        create_dataset_yaml_file(dataset_folder, capture['dataset_name'], capture['class_names'],
+                                 *[[os.path.relpath(shard, dataset_folder) for shard in shards.shard_files(shard_folder, split)] for split in dataset_splits])
+        if coco:
+            logging.warning("COCO export isn't supported for sharded datasets")
+    elif coco:
+        export_coco(dataset_folder, capture['class_names'])
 
 def capture_ui(app: str, output_folder: str,
                width: int, height: int, iterations: int, 
                widget_list: list, widget_count: int, delay_count: int, split_widgets: bool, 
                split_ratio: tuple = None,
-               dataset_name: str = 'custom', layout: str = None) -> None:
-    image_paths = []
+               dataset_name: str = 'custom', layout: str = None, workers: int = 1,
+               watch_output: bool = False, timeout: float = None, retries: int = 0,
+               resume: bool = False, append: bool = False, seed: int = None, coco: bool = False,
+               shard_size: int = None, metrics_file: str = None, progress: bool = False,
+               dedup_threshold: int = None, dedup_rerenders: int = 0, class_targets: dict = None,
+               start_index: int = 0, cache_folder: str = None, cache_size: int = 10 << 30, augmentation: dict = None,
+               staging_folder: str = None, staging_batch: int = 1000, staging_size: int = 1 << 30, splits: List[str] = None) -> None:
+    """
+    Render UIs with the generator binary and place them into a dataset
+
+    The split of every sample is decided up front, so the generator writes its image straight into the image folder of the split.
+    Every placed sample is recorded in the manifest of the dataset.
+    resume: skip all samples already recorded in the manifest (e.g. to continue a crashed run)
+    append: add iterations more samples after the last recorded sample to an existing dataset
+    seed: seed for the split assignment
+    coco: additionally export COCO annotation files for every split into the annotations folder of the dataset
+    shard_size: pack samples into tar shards of at most shard_size bytes per split instead of loose image and label files
+    metrics_file: write the per-stage timings and counters of the run into this file (Prometheus textfile format for .prom files, JSON otherwise)
+    progress: print a live progress line with throughput and ETA
+    dedup_threshold: drop renders whose perceptual hash is within this Hamming distance of an already known render of the dataset
+    dedup_rerenders: amount of times a near-duplicate render is rendered again before it is dropped
+    class_targets: amount of instances to generate per widget type, a planner then chooses widget list, count and layout of each render
+                   (up to widget_count widgets and iterations renders) and assigns stratified splits instead
+    start_index: index of the first iteration, so parts of a job rendered on different nodes get distinct file names
+    cache_folder: serve renders with equal parameters from this content-addressed render cache and add new renders to it
+    cache_size: maximum size of the render cache in bytes, the least recently used renders are evicted beyond it
+    augmentation: settings of the augmentation stage (see util.augment), every placed sample gets augmented copies in its split after the run
+    staging_folder: render and post-process in a temporary folder below this folder (e.g. a tmpfs) and move finished samples into the dataset
+                    in batches per split, every batch appears at once as a subfolder of its split and is recorded in the manifest afterwards
+                    (files of batches which weren't recorded before a crash are removed by resume and append)
+    staging_batch: amount of samples per flushed batch
+    staging_size: maximum size of the staged samples in bytes before a batch is flushed, renders wait while the previous batch is still flushing
+    splits: split of every iteration starting at start_index (e.g. a slice of the splits of a whole job), instead of drawing them from the seed
+    """
+    metrics.reset()
     os.makedirs(output_folder, exist_ok=True)
-    for i in range(iterations):
-        output_file_base = f"ui_{'-'.join(widget_list)}_{i}"
-        output_file_image = f"{output_file_base}.jpg"
-        output_file_with_char = f"/{output_file_image}"
-        if split_widgets:
-            for widget in widget_list:
-                output_file_base = f"ui_{widget}_{i}"
-                output_file_image = f"{output_file_base}.jpg"
-                output_file_with_char = f"/{output_file_image}"
-                output_image_path = os.path.join(output_folder, output_file_image)
-                run_ui_generator(app, output_folder, width, height, [widget], widget_count, output_file_with_char, delay_count, layout)
-                image_paths.append(output_image_path)
-        else:
-            output_image_path = os.path.join(output_folder, output_file_image)
-            run_ui_generator(app, output_folder, width, height, widget_list, widget_count, output_file_with_char, delay_count, layout)
-            image_paths.append(output_image_path)
-    # Get new list of real widget names from the classes dictionary
+    manifest_file = manifest.manifest_path(os.path.join(output_folder, dataset_name))
+    records = list(manifest.read_manifest(manifest_file)) if resume or append else []
+    last_index = max((record['index'] for record in records), default=start_index - 1)
+    class_planner = None
+    if class_targets is not None:
+        # Continue the tallies of an existing dataset and plan renders lazily while their results arrive
+        widget_list = list(class_targets.keys())
+        class_planner = planner.create_planner(class_targets, widget_count, [layout], split_ratio or (0.7, 0.1, 0.2), dataset_splits)
+        for record in records:
+            planner.record_sample(class_planner, None, record.get('classes', {}), record['split'])
+        jobs = planner.plan_jobs(class_planner, iterations, start=last_index + 1)
+        total_jobs = iterations
+    else:
+        jobs = create_render_jobs(iterations, widget_list, split_widgets, start=last_index + 1 if append else start_index)
+        if splits is not None and not append:
+            for job in jobs:
+                job['split'] = splits[job['index'] - start_index]
+        if resume:
+            # Splits are drawn over all jobs of the run, so the remaining jobs get the same splits as in an uninterrupted run
+            assign_job_splits(jobs, split_ratio, seed)
+            finished = {record['output_file'] for record in records}
+            jobs = [job for job in jobs if job['output_file'] not in finished]
+            logging.info("Resuming with %i of %i remaining renders", len(jobs), len(jobs) + len(finished))
+        total_jobs = len(jobs)
+
+    # Prepare the dataset, so every finished render can be placed right away
+    capture = open_capture(output_folder, dataset_name, jobs, widget_list, width, height, widget_count, delay_count, layout,
+                           split_ratio, seed, shard_size, dedup_threshold, class_planner, resume, append, augmentation,
+                           staging_folder, staging_batch, staging_size)
+
+    # Post-process finished renders while later renders are still running
+    def process_sample(sample: Tuple[dict, str]) -> None:
+        job, image_path = sample
+        with metrics.timed('post_process'):
+            capture['post_process'](job, image_path)
+        metrics.increment('processed')
+        if progress:
+            metrics.print_progress(metrics.counter('processed'), total_jobs)
+
+    cache = render_cache.open_cache(cache_folder, cache_size) if cache_folder is not None else None
+    on_failure = (lambda sample: capture['on_failure'](sample[0])) if capture['on_failure'] is not None else None
+    stage = pipeline.start_stage(process_sample, queue_size=max(workers, 1) * 4, on_drop=on_failure)
+    # The report is also written for failed runs
+    try:
+        try:
+            run_ui_generator_pool(app, output_folder, capture['jobs'], width, height, widget_count, delay_count, layout, workers, watch_output, timeout, retries,
+                                  on_render=lambda job, image_path: pipeline.submit(stage, (job, image_path)),
+                                  accept=capture['accept'], rerenders=dedup_rerenders, on_drop=capture['on_drop'], cache=cache)
+        finally:
+            # Samples already staged or indexed are kept even if post-processing failed
+            try:
+                pipeline.finish(stage)
+            finally:
+                close_capture(capture)
+        complete_capture(capture, coco)
+    finally:
+        if metrics_file is not None:
+            metrics.write_report(metrics_file)
+
+def capture_matrix(app: str, output_folder: str, groups: List[dict], workers: int = 1,
+                   watch_output: bool = False, timeout: float = None, retries: int = 0,
+                   split_ratio: tuple = None, seed: int = None, coco: bool = False,
+                   shard_size: int = None, metrics_file: str = None, progress: bool = False,
+                   dedup_threshold: int = None, dedup_rerenders: int = 0,
+                   cache_folder: str = None, cache_size: int = 10 << 30,
+                   staging_folder: str = None, staging_batch: int = 1000, staging_size: int = 1 << 30) -> None:
+    """
+    Render a matrix of job groups with a single worker pool and post-processing pipeline
+
+    groups: list of dictionaries with dataset, widget_types, width, height, widget_count, layout, delay_count, iterations and split_widgets
+            of every group (see util.matrix)
+
+    Groups of the same dataset share its class list and are numbered consecutively, so their file names can't collide.
+    The split ratio is applied to every group on its own. See capture_ui() for the remaining parameters.
+    """
+    metrics.reset()
+    os.makedirs(output_folder, exist_ok=True)
+    dataset_groups = {}
+    for group_number, group in enumerate(groups):
+        dataset_groups.setdefault(group['dataset'], []).append((group_number, group))
+
+    captures = {}
+    for dataset_name, groups_of_dataset in dataset_groups.items():
+        jobs = []
+        widget_list = []
+        start = 0
+        for group_number, group in groups_of_dataset:
+            group_jobs = create_render_jobs(group['iterations'], group['widget_types'], group['split_widgets'], start=start)
+            # Every group gets its own seed, so groups of equal size don't share the same split permutation
+            group_seed = distributed.derive_seed(seed, group_number) if seed is not None else None
+            if split_ratio is None:
+                splits = assign_splits(len(group_jobs), seed=group_seed)
+            else:
+                splits = assign_splits(len(group_jobs), split_ratio, group_seed)
+            for job, split in zip(group_jobs, splits):
+                job.update(dataset=dataset_name, split=split, **{key: group[key] for key in ('width', 'height', 'widget_count', 'delay_count', 'layout')})
+            jobs.extend(group_jobs)
+            widget_list.extend(widget for widget in group['widget_types'] if widget not in widget_list)
+            start += group['iterations']
+        first = groups_of_dataset[0][1]
+        captures[dataset_name] = open_capture(output_folder, dataset_name, jobs, widget_list, first['width'], first['height'], first['widget_count'],
+                                              first['delay_count'], first['layout'], split_ratio, seed, shard_size, dedup_threshold,
+                                              staging_folder=staging_folder, staging_batch=staging_batch, staging_size=staging_size)
+    total_jobs = sum(len(capture['jobs']) for capture in captures.values())
+    logging.info("Rendering %i UIs into %i datasets", total_jobs, len(captures))
+
+    def process_sample(sample: Tuple[dict, str]) -> None:
+        job, image_path = sample
+        with metrics.timed('post_process'):
+            captures[job['dataset']]['post_process'](job, image_path)
+        metrics.increment('processed')
+        if progress:
+            metrics.print_progress(metrics.counter('processed'), total_jobs)
+
+    accept = None
+    if dedup_threshold is not None:
+        def accept(job: dict, image_path: str) -> bool:
+            return captures[job['dataset']]['accept'](job, image_path)
+
+    cache = render_cache.open_cache(cache_folder, cache_size) if cache_folder is not None else None
+    stage = pipeline.start_stage(process_sample, queue_size=max(workers, 1) * 4)
+    try:
+        try:
+            first = groups[0]
+            run_ui_generator_pool(app, output_folder, itertools.chain.from_iterable(capture['jobs'] for capture in captures.values()),
+                                  first['width'], first['height'], first['widget_count'], first['delay_count'], first['layout'], workers, watch_output, timeout, retries,
+                                  on_render=lambda job, image_path: pipeline.submit(stage, (job, image_path)),
+                                  accept=accept, rerenders=dedup_rerenders, cache=cache)
+        finally:
+            # Samples already staged or indexed are kept even if post-processing failed
+            try:
+                pipeline.finish(stage)
+            finally:
+                close_captures(list(captures.values()))
+        for capture in captures.values():
+            complete_capture(capture, coco)
+    finally:
+        if metrics_file is not None:
+            metrics.write_report(metrics_file)
+
+def compose_ui(source_folders: List[str], output_folder: str, width: int, height: int, iterations: int,
+               widget_list: List[str], widget_count: int, split_ratio: tuple = None, dataset_name: str = 'custom',
+               seed: int = None, workers: int = None, coco: bool = False, metrics_file: str = None, batch_size: int = 64) -> None:
+    """
+    Compose multi-widget UIs from single-widget renders instead of running the generator binary
+
+    source_folders: datasets of single-widget renders (e.g. created with --single or --split_widgets) or render cache folders
+    widget_count: amount of widgets per UI, widgets without a free position on the canvas are left out
+
+    Crops of a dataset are only used for UIs of the same split, crops of a render cache for all splits.
+    UIs are composed in batches of batch_size in a pool of workers processes (all cores by default).
+    See capture_ui() for the remaining parameters.
+    """
+    metrics.reset()
     class_names = [classes[widget]['name'] for widget in widget_list]
-    dataset_generation(output_folder=output_folder, name=dataset_name, images=image_paths, width=width, height=height, class_names=class_names, split_ratio=split_ratio)
+    crops = {split: [] for split in dataset_splits}
+    with metrics.timed('crops'):
+        for folder in source_folders:
+            if os.path.exists(manifest.manifest_path(folder)):
+                for split, split_crops in compositor.load_dataset_crops(folder, class_names).items():
+                    crops[split].extend(split_crops)
+            else:
+                cache_crops = compositor.load_cache_crops(folder, class_names)
+                for split in dataset_splits:
+                    crops[split].extend(cache_crops)
+    logging.info("Loaded %s crops", ', '.join(f"{len(crops[split])} {split}" for split in dataset_splits))
 
-if __name__ == "__main__":
+    dataset_folder = os.path.join(output_folder, dataset_name)
+    split_folders = create_dataset_folders(output_folder, dataset_name)
+    create_dataset_yaml_file(dataset_folder, dataset_name, class_names, *[f"images/{split}" for split in dataset_splits])
+    if split_ratio is None:
+        splits = assign_splits(iterations, seed=seed)
+    else:
+        splits = assign_splits(iterations, split_ratio, seed)
+    jobs = []
+    for i, split in enumerate(splits):
+        output_file = f"ui_composed_{i}.jpg"
+        image_folder, label_folder = split_folders[split]
+        jobs.append({'index': i, 'widgets': widget_list, 'split': split, 'widget_count': widget_count, 'output_file': output_file,
+                     'image_path': os.path.join(image_folder, output_file), 'label_path': os.path.join(label_folder, output_file.replace('.jpg', '.txt'))})
+    missing = sorted({job['split'] for job in jobs if not crops[job['split']]})
+    if missing:
+        raise ValueError(f"No single-widget crops of {', '.join(widget_list)} for the split {', '.join(missing)}")
+
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+    class_ids = labels.class_id_map(class_names)
+    compose_batch = functools.partial(compositor.compose_batch, width=width, height=height, class_ids=class_ids, seed=seed)
+    try:
+        index_writer = annotation_index.open_index_writer(dataset_folder, dataset_splits)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=compositor.init_worker, initargs=(crops,)) as executor, \
+                    manifest.open_manifest(manifest.manifest_path(dataset_folder), append=False) as manifest_handle, metrics.timed('compose'):
+                for written in executor.map(compose_batch, batches):
+                    for job, boxes in written:
+                        class_counts = {}
+                        for class_name, *_ in boxes:
+                            class_counts[widget_names[class_name]] = class_counts.get(widget_names[class_name], 0) + 1
+                        record = manifest.sample_record(job, dataset_folder, job['image_path'], job['label_path'], width=width, height=height, widget_count=widget_count,
+                                                        classes=class_counts, composed=True)
+                        manifest.write_record(manifest_handle, record)
+                        annotation_index.add_sample(index_writer, record['image'], job['split'], width, height,
+                                                    [int(class_ids[class_name]) for class_name, *_ in boxes], [box for _, *box in boxes])
+                    metrics.increment('samples', len(written))
+        finally:
+            annotation_index.close_index_writer(index_writer)
+        logging.info("Composed %i UIs", len(jobs))
+
+        if coco:
+            export_coco(dataset_folder, class_names)
+    finally:
+        if metrics_file is not None:
+            metrics.write_report(metrics_file)
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    """
+    Create the command line parser of the randomizer
+    """
     parser = argparse.ArgumentParser(description='Capture UI and create image and annotation with correct folders.')
     parser.add_argument('-p', '--app_path', required=True, help='Path to the random UI generator binary')
     parser.add_argument('-i', '--iterations', type=int, default=10, help='Number of UIs to generate')
@@ -213,49 +1086,96 @@ if __name__ == "__main__":
     parser.add_argument('-d','--delay_count', type=int, default=10, help='Amount of times the timer handler shall be called with a fixed delay before capturing the UI')
     parser.add_argument('--split_widgets', action='store_true', help='Split widgets into subfolders (only creates one widget type per iteration)')
     parser.add_argument('-l', '--layout', type=str, default=None, help='Path to the layout file to be used')
-    parser.add_argument('-r', '--split_ratio', type=str, default=None, help='Split ratio for train, val, test')
+    parser.add_argument('-r', '--split_ratio', type=parse_split_ratio, default=None, help='Split ratio for train, val, test (e.g. 0.7,0.1,0.2)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the train, val, test split assignment')
+    parser.add_argument('--coco', action='store_true', help='Additionally export COCO annotation files for every split')
+    parser.add_argument('--metrics', default=None, help='Write per-stage timings and counters of the run into this file (.prom for Prometheus textfile format, JSON otherwise)')
+    parser.add_argument('--progress', action='store_true', help='Show a live progress line with throughput and ETA')
+    parser.add_argument('--dedup', type=int, default=None, metavar='DISTANCE', help='Drop UIs within this Hamming distance of the perceptual hash of an already generated UI')
+    parser.add_argument('--dedup_rerenders', type=int, default=0, help='Amount of times a near-duplicate UI is rendered again before it is dropped')
+    parser.add_argument('--targets', type=parse_class_target, nargs='+', default=None, metavar='WIDGET=INSTANCES',
+                        help='Instance targets per widget type, renders are planned until all targets are reached (iterations is the maximum amount of renders)')
+    parser.add_argument('--shards', type=int, default=None, metavar='SIZE_MB', help='Pack samples into tar shards of at most SIZE_MB megabytes per split')
+    parser.add_argument('--cache', default=None, metavar='FOLDER', help='Serve renders with equal parameters from this render cache and add new renders to it')
+    parser.add_argument('--cache_size', type=float, default=10, metavar='SIZE_GB', help='Maximum size of the render cache, least recently used renders are evicted beyond it')
+    parser.add_argument('--augment', type=int, default=0, metavar='COPIES', help='Amount of augmented copies of every UI (rescaled, colour shifted and flipped where valid)')
+    parser.add_argument('--augment_sizes', type=parse_image_size, nargs='+', default=None, metavar='WIDTHxHEIGHT', help='Target resolutions of the augmented copies')
+    parser.add_argument('--letterbox', action='store_true', help='Keep the aspect ratio of augmented copies and pad them to the target resolution')
+    parser.add_argument('--brightness', type=float, default=0.2, help='Maximum relative brightness shift of augmented copies')
+    parser.add_argument('--color', type=float, default=0.1, help='Maximum relative colour channel shift of augmented copies')
+    parser.add_argument('--no_flip', action='store_true', help="Don't mirror augmented copies")
+    parser.add_argument('--staging', default=None, metavar='FOLDER', help='Render into a temporary folder below FOLDER (e.g. /dev/shm) and move finished UIs into the dataset in batches')
+    parser.add_argument('--staging_batch', type=int, default=1000, help='Amount of UIs moved into the dataset per batch')
+    parser.add_argument('--staging_size', type=int, default=1024, metavar='SIZE_MB', help='Maximum size of the staged UIs before a batch is moved into the dataset')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Number of generator processes to run in parallel')
+    parser.add_argument('--watch', action='store_true', help='End the generator as soon as the image and label files are complete')
+    parser.add_argument('--timeout', type=float, default=None, help='Hard timeout in seconds for a single render')
+    parser.add_argument('--retries', type=int, default=0, help='Amount of retries for a failed or timed out render')
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument('--resume', action='store_true', help='Skip all UIs already recorded in the manifest of the dataset')
+    resume_group.add_argument('--append', action='store_true', help='Add the amount of iterations to an existing dataset')
     group = parser.add_mutually_exclusive_group(required=True)
     # Add boolean switch A
     group.add_argument('-s', '--single', action='store_true', help='Create only a single widget per iteration')
 
     # Add boolean switch B with additional parameter
     group.add_argument('-m', '--multi', action='store', type=int, help='Create multiple widgets per iteration')
+    return parser
 
-    args = parser.parse_args()
-
-    print(args)
+def run(args: argparse.Namespace, start_index: int = 0, splits: List[str] = None) -> None:
+    """
+    Run the randomizer with parsed command line arguments
 
+    start_index: index of the first iteration (e.g. of a part of a job split across multiple nodes)
+    splits: split of every iteration, see capture_ui()
+    """
     # Check if widget types are valid
     for widget in args.widget_types:
         if widget not in classes.keys():
             print(f"Widget type {widget} not supported. Please use one of the following: {', '.join(classes.keys())}")
-            exit(1)
-
-    if args.single:
-        capture_ui(
-            app=os.path.abspath(args.app_path),
-            output_folder=os.path.abspath(args.output_folder),
-            width=args.width,
-            height=args.height,
-            iterations=args.iterations,
-            widget_list=args.widget_types,
-            widget_count=1,
-            delay_count=args.delay_count,
-            split_widgets=args.split_widgets,
-            split_ratio=args.split_ratio,
-            layout=args.layout
-        )
-    elif args.multi is not None:
-        capture_ui(
-            app=os.path.abspath(args.app_path),
-            output_folder=os.path.abspath(args.output_folder),
-            width=args.width,
-            height=args.height,
-            iterations=args.iterations,
-            widget_list=args.widget_types,
-            widget_count=args.multi,
-            delay_count=args.delay_count,
-            split_widgets=args.split_widgets,
-            split_ratio=args.split_ratio,
-            layout=args.layout
-        )
\ No newline at end of file
+            sys.exit(1)
+
+    capture_ui(
+        app=os.path.abspath(args.app_path),
+        output_folder=os.path.abspath(args.output_folder),
+        width=args.width,
+        height=args.height,
+        iterations=args.iterations,
+        widget_list=args.widget_types,
+        widget_count=1 if args.single else args.multi,
+        delay_count=args.delay_count,
+        split_widgets=args.split_widgets,
+        split_ratio=args.split_ratio,
+        layout=args.layout,
+        workers=args.workers,
+        watch_output=args.watch,
+        timeout=args.timeout,
+        retries=args.retries,
+        resume=args.resume,
+        append=args.append,
+        seed=args.seed,
+        coco=args.coco,
+        shard_size=args.shards << 20 if args.shards is not None else None,
+        metrics_file=args.metrics,
+        progress=args.progress,
+        dedup_threshold=args.dedup,
+        dedup_rerenders=args.dedup_rerenders,
+        class_targets=dict(args.targets) if args.targets is not None else None,
+        start_index=start_index,
+        splits=splits,
+        cache_folder=os.path.abspath(args.cache) if args.cache is not None else None,
+        cache_size=int(args.cache_size * (1 << 30)),
+        staging_folder=os.path.abspath(args.staging) if args.staging is not None else None,
+        staging_batch=args.staging_batch,
+        staging_size=args.staging_size << 20,
+        augmentation=augment.create_augmentation(args.augment, args.augment_sizes, args.letterbox, args.brightness, args.color,
+                                                 not args.no_flip, seed=args.seed) if args.augment > 0 else None
+    )
+
+if __name__ == "__main__":
+    args = create_argument_parser().parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    print(args)
+
+    run(args)
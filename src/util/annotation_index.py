@@ -0,0 +1,271 @@
+import os
+import json
+import logging
+import numpy as np
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Generator
+
+from util import manifest
+from util import normalize
+from util import metrics
+
+INDEX_FOLDER = 'index'
+META_FILE = 'index.json'
+IMAGES_FILE = 'images.txt'
+
+# Columns of the index, one raw file per field which is memory-mapped for reading
+BOX_FIELDS = {'image_id': np.uint32, 'class_id': np.uint16, 'x': np.float32, 'y': np.float32, 'w': np.float32, 'h': np.float32}
+IMAGE_FIELDS = {'split': np.uint8, 'width': np.uint32, 'height': np.uint32}
+# Class id of boxes whose class isn't a valid id (e.g. unknown class names kept by labels.fix_label_line()), reported by validate()
+INVALID_CLASS_ID = np.iinfo(BOX_FIELDS['class_id']).max
+
+def class_id_column(class_column: List[str]) -> np.ndarray:
+    """
+    Class ids of a class column of label files, tokens which aren't a valid class id are stored as INVALID_CLASS_ID
+    """
+    class_ids = np.full(len(class_column), INVALID_CLASS_ID, dtype=np.int64)
+    for i, token in enumerate(class_column):
+        if token.isdigit() and int(token) < INVALID_CLASS_ID:
+            class_ids[i] = int(token)
+    return class_ids
+
+def index_folder(dataset_folder: str) -> str:
+    """
+    Folder of the annotation index of a dataset
+    """
+    return os.path.join(dataset_folder, INDEX_FOLDER)
+
+def read_meta(folder: str) -> dict:
+    path = os.path.join(folder, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_meta(folder: str, meta: dict) -> None:
+    """
+    Atomically write the meta data of an index, only rows counted in it are part of the index
+    """
+    temporary_path = os.path.join(folder, META_FILE + '.tmp')
+    with open(temporary_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temporary_path, os.path.join(folder, META_FILE))
+
+def indexed_samples(dataset_folder: str) -> int:
+    """
+    Amount of samples with label files in the manifest of a dataset
+    """
+    return sum(1 for record in manifest.read_manifest(manifest.manifest_path(dataset_folder)) if 'shard' not in record)
+
+def open_index_writer(dataset_folder: str, splits: List[str], append: bool = False, flush_interval: int = 1000) -> dict:
+    """
+    Open the annotation index of a dataset for adding samples
+
+    append: keep the indexed samples, the index is rebuilt from the manifest if it doesn't match it (e.g. after a crash)
+    flush_interval: amount of samples buffered in memory before they are written
+
+    Rows written after the last flush of a crashed run are cut off when the index is opened again.
+
+    Returns the writer as dictionary to be passed to the other functions of this module
+    """
+    folder = index_folder(dataset_folder)
+    os.makedirs(folder, exist_ok=True)
+    meta = read_meta(folder) if append else None
+    if append and (meta is None or meta['images'] != indexed_samples(dataset_folder)):
+        logging.info("Rebuilding the annotation index of %s from its manifest", dataset_folder)
+        build_index(dataset_folder, splits)
+        meta = read_meta(folder)
+    if meta is None:
+        meta = {'splits': list(splits), 'images': 0, 'boxes': 0}
+    # Cut off rows which were written but not counted before a crash
+    for field, dtype in BOX_FIELDS.items():
+        with open(os.path.join(folder, f"{field}.bin"), 'ab') as f:
+            f.truncate(meta['boxes'] * np.dtype(dtype).itemsize)
+    for field, dtype in IMAGE_FIELDS.items():
+        with open(os.path.join(folder, f"{field}.bin"), 'ab') as f:
+            f.truncate(meta['images'] * np.dtype(dtype).itemsize)
+    images_path = os.path.join(folder, IMAGES_FILE)
+    image_paths = []
+    if meta['images'] and os.path.exists(images_path):
+        with open(images_path, 'r') as f:
+            image_paths = [line for _, line in zip(range(meta['images']), f)]
+    with open(images_path, 'w') as f:
+        f.writelines(image_paths)
+    writer = {
+        'folder': folder,
+        'meta': meta,
+        'split_ids': {split: i for i, split in enumerate(meta['splits'])},
+        'handles': {field: open(os.path.join(folder, f"{field}.bin"), 'ab') for field in (*BOX_FIELDS, *IMAGE_FIELDS)},
+        'images': open(images_path, 'a'),
+        'flush_interval': flush_interval,
+        'pending': [],
+    }
+    write_meta(folder, meta)
+    return writer
+
+def add_sample(writer: dict, image_path: str, split: str, width: int, height: int, class_ids: np.ndarray, boxes: np.ndarray) -> int:
+    """
+    Add a sample with its normalized bounding boxes (array of shape (boxes, 4)) to the index
+
+    image_path: path of the image relative to the dataset folder
+
+    Returns the image id of the sample
+    """
+    image_id = writer['meta']['images'] + len(writer['pending'])
+    writer['pending'].append((image_path, writer['split_ids'][split], width, height, np.asarray(class_ids), np.asarray(boxes).reshape(-1, 4)))
+    if len(writer['pending']) >= writer['flush_interval']:
+        flush_index(writer)
+    return image_id
+
+def add_label_file(writer: dict, dataset_folder: str, image_path: str, label_path: str, split: str, width: int, height: int) -> int:
+    """
+    Add a sample with its normalized YOLO label file to the index
+
+    Lines with unknown classes are indexed with INVALID_CLASS_ID instead of aborting
+    Returns the image id of the sample
+    """
+    class_column, boxes, _ = normalize.load_label_files([label_path])
+    return add_sample(writer, os.path.relpath(image_path, dataset_folder), split, width, height, class_id_column(class_column), boxes)
+
+def flush_index(writer: dict) -> None:
+    """
+    Write all buffered samples into the columns of the index and count them in its meta data
+    """
+    pending = writer['pending']
+    if not pending:
+        return
+    with metrics.timed('index'):
+        meta = writer['meta']
+        counts = np.array([len(sample[4]) for sample in pending])
+        image_ids = np.repeat(np.arange(meta['images'], meta['images'] + len(pending)), counts)
+        boxes = np.concatenate([sample[5] for sample in pending])
+        columns = {
+            'image_id': image_ids,
+            'class_id': np.concatenate([sample[4] for sample in pending]),
+            'x': boxes[:, 0], 'y': boxes[:, 1], 'w': boxes[:, 2], 'h': boxes[:, 3],
+            'split': np.array([sample[1] for sample in pending]),
+            'width': np.array([sample[2] for sample in pending]),
+            'height': np.array([sample[3] for sample in pending]),
+        }
+        for field, dtype in {**BOX_FIELDS, **IMAGE_FIELDS}.items():
+            handle = writer['handles'][field]
+            handle.write(columns[field].astype(dtype).tobytes())
+            handle.flush()
+        writer['images'].writelines(f"{sample[0]}\n" for sample in pending)
+        writer['images'].flush()
+        meta['images'] += len(pending)
+        meta['boxes'] += int(counts.sum())
+        write_meta(writer['folder'], meta)
+        writer['pending'] = []
+
+def close_index_writer(writer: dict) -> None:
+    flush_index(writer)
+    for handle in writer['handles'].values():
+        handle.close()
+    writer['images'].close()
+
+def build_index(dataset_folder: str, splits: List[str], batch_size: int = 10000) -> int:
+    """
+    Build the annotation index of a dataset from its manifest and label files
+
+    Returns the amount of indexed samples
+    """
+    writer = open_index_writer(dataset_folder, splits, flush_interval=batch_size)
+    try:
+        records = [record for record in manifest.read_manifest(manifest.manifest_path(dataset_folder)) if 'shard' not in record]
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            class_column, boxes, counts = normalize.load_label_files([os.path.join(dataset_folder, record['label']) for record in batch])
+            class_ids = class_id_column(class_column)
+            offsets = np.cumsum([0] + counts)
+            for i, record in enumerate(batch):
+                add_sample(writer, record['image'], record['split'], record['width'], record['height'],
+                           class_ids[offsets[i]:offsets[i + 1]], boxes[offsets[i]:offsets[i + 1]])
+    finally:
+        close_index_writer(writer)
+    return writer['meta']['images']
+
+def load_index(dataset_folder: str) -> dict:
+    """
+    Memory-map the columns of the annotation index of a dataset
+
+    Returns a dictionary with the splits, the image paths (relative to the dataset folder) and an array per field
+    """
+    folder = index_folder(dataset_folder)
+    meta = read_meta(folder)
+    if meta is None:
+        raise FileNotFoundError(f"No annotation index in {dataset_folder}")
+    index = {'splits': meta['splits']}
+    for fields, count in ((BOX_FIELDS, meta['boxes']), (IMAGE_FIELDS, meta['images'])):
+        for field, dtype in fields.items():
+            path = os.path.join(folder, f"{field}.bin")
+            index[field] = np.memmap(path, dtype=dtype, mode='r', shape=(count,)) if count else np.empty(0, dtype=dtype)
+    with open(os.path.join(folder, IMAGES_FILE), 'r') as f:
+        index['image_paths'] = [line.rstrip('\n') for _, line in zip(range(meta['images']), f)]
+    return index
+
+def class_counts(index: dict, num_classes: int) -> Dict[str, np.ndarray]:
+    """
+    Amount of boxes per class id in every split
+    """
+    box_splits = index['split'][index['image_id']].astype(np.int64)
+    valid = index['class_id'] < num_classes
+    counts = np.bincount(box_splits[valid] * num_classes + index['class_id'][valid], minlength=len(index['splits']) * num_classes)
+    return {split: counts[i * num_classes:(i + 1) * num_classes] for i, split in enumerate(index['splits'])}
+
+def box_size_histogram(index: dict, bins: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Histogram of the box sizes in pixels (square root of the box area)
+
+    Returns the counts and the bin edges
+    """
+    width = index['width'][index['image_id']]
+    height = index['height'][index['image_id']]
+    sizes = np.sqrt(np.abs(index['w'] * width * index['h'] * height))
+    return np.histogram(sizes[np.isfinite(sizes)], bins=bins)
+
+def validate(index: dict, num_classes: int, tolerance: float = 1e-4) -> Dict[str, np.ndarray]:
+    """
+    Find invalid boxes and images of an index
+
+    Boxes reaching outside of the image by more than tolerance (in normalized coordinates) count as out of bounds
+
+    Returns a dictionary with the ids of the offending images per issue
+    """
+    x, y, w, h = index['x'], index['y'], index['w'], index['h']
+    finite = np.isfinite(x) & np.isfinite(y) & np.isfinite(w) & np.isfinite(h)
+    out_of_bounds = (x - w / 2 < -tolerance) | (y - h / 2 < -tolerance) | (x + w / 2 > 1 + tolerance) | (y + h / 2 > 1 + tolerance)
+    boxes_per_image = np.bincount(index['image_id'], minlength=len(index['split']))
+    issues = {
+        'not_finite': ~finite,
+        'out_of_bounds': finite & out_of_bounds,
+        'empty_boxes': finite & ((w <= 0) | (h <= 0)),
+        'invalid_class': index['class_id'] >= num_classes,
+    }
+    result = {issue: np.unique(index['image_id'][mask]) for issue, mask in issues.items()}
+    result['images_without_boxes'] = np.flatnonzero(boxes_per_image == 0)
+    return result
+
+def coco_samples(index: dict, split: str, num_classes: int = None) -> Generator[Tuple[str, int, int, list], None, None]:
+    """
+    Generator for the samples of a split in the format of yolo_to_coco.yolo_samples(), read from the index instead of the label files
+
+    Boxes with an invalid class id (INVALID_CLASS_ID or, if num_classes is provided, any id without a category) are left out and counted
+    """
+    split_id = index['splits'].index(split)
+    limit = min(num_classes, INVALID_CLASS_ID) if num_classes is not None else INVALID_CLASS_ID
+    skipped = 0
+    # Boxes are stored in order of their image
+    starts = np.searchsorted(index['image_id'], np.arange(len(index['split']) + 1))
+    for image_id in np.flatnonzero(index['split'] == split_id):
+        start, end = starts[image_id], starts[image_id + 1]
+        valid = index['class_id'][start:end] < limit
+        skipped += int((~valid).sum())
+        rows = list(zip(index['class_id'][start:end][valid].tolist(), index['x'][start:end][valid].tolist(), index['y'][start:end][valid].tolist(),
+                        index['w'][start:end][valid].tolist(), index['h'][start:end][valid].tolist()))
+        yield os.path.basename(index['image_paths'][image_id]), int(index['width'][image_id]), int(index['height'][image_id]), rows
+    if skipped:
+        logging.warning("Left %i boxes with invalid classes out of the %s split", skipped, split)
+        metrics.increment('invalid_class_boxes', skipped)
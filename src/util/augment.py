@@ -0,0 +1,156 @@
+import os
+import zlib
+import logging
+import numpy as np
+from PIL import Image
+from typing import List
+from typing import Tuple
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from util import normalize
+from util import metrics
+
+# Gray value of the padding of letterboxed images
+LETTERBOX_COLOR = 114
+
+def create_augmentation(copies: int, sizes: List[Tuple[int, int]] = None, letterbox: bool = False,
+                        brightness: float = 0.0, color: float = 0.0, flip: bool = True, flip_class_ids: List[str] = None, seed: int = None) -> dict:
+    """
+    Create the settings of the augmentation stage
+
+    copies: amount of augmented samples per render
+    sizes: target resolutions (width, height), copy k is rescaled to sizes[k % len(sizes)] (None keeps the size of the render)
+    letterbox: keep the aspect ratio and pad to the target resolution instead of stretching
+    brightness: maximum relative brightness shift (e.g. 0.2 for 80% to 120%)
+    color: maximum relative shift of every colour channel
+    flip: mirror half of the copies horizontally where valid
+    flip_class_ids: class ids which stay valid when mirrored, a sample is only flipped if all of its classes are listed
+    seed: seed of the random shifts and flips, the augmentation of a sample is reproducible if a seed is provided
+
+    Returns the settings as dictionary to be passed to the other functions of this module
+    """
+    return {
+        'copies': copies,
+        'sizes': list(sizes) if sizes else [None],
+        'letterbox': letterbox,
+        'brightness': brightness,
+        'color': color,
+        'flip': flip,
+        'flip_class_ids': set(flip_class_ids or []),
+        'seed': seed,
+    }
+
+def augmented_path(path: str, copy: int) -> str:
+    """
+    Path of an augmented copy of an image or label file (e.g. ui_button_3_aug0.jpg)
+    """
+    stem, extension = os.path.splitext(path)
+    return f"{stem}_aug{copy}{extension}"
+
+def letterbox_geometry(source_size: Tuple[int, int], target_size: Tuple[int, int], letterbox: bool) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Size of the rescaled image and its offset inside the target image
+
+    Without letterbox the image is stretched to the target size
+    """
+    if not letterbox:
+        return target_size, (0, 0)
+    scale = min(target_size[0] / source_size[0], target_size[1] / source_size[1])
+    scaled_size = (max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale)))
+    return scaled_size, ((target_size[0] - scaled_size[0]) // 2, (target_size[1] - scaled_size[1]) // 2)
+
+def transform_boxes(boxes: np.ndarray, scale: np.ndarray, offset: np.ndarray, flip: np.ndarray) -> np.ndarray:
+    """
+    Transform normalized YOLO bounding boxes of any amount of samples at once
+
+    boxes: array of shape (lines, 4) with x, y, width and height
+    scale: array of shape (lines, 2) with the size of the rescaled image relative to the target image
+    offset: array of shape (lines, 2) with the offset of the rescaled image relative to the target image
+    flip: boolean array of shape (lines,) telling which boxes are mirrored horizontally
+    """
+    centers = boxes[:, :2].copy()
+    centers[flip, 0] = 1 - centers[flip, 0]
+    return np.concatenate((centers * scale + offset, boxes[:, 2:] * scale), axis=1)
+
+def transform_image(pixels: np.ndarray, target_size: Tuple[int, int], scaled_size: Tuple[int, int], offset: Tuple[int, int],
+                    flip: bool, gain: np.ndarray) -> np.ndarray:
+    """
+    Rescale, pad, mirror and colour shift an RGB image given as array of shape (height, width, 3)
+    """
+    if flip:
+        pixels = pixels[:, ::-1]
+    if scaled_size != (pixels.shape[1], pixels.shape[0]):
+        pixels = np.asarray(Image.fromarray(np.ascontiguousarray(pixels)).resize(scaled_size, Image.BILINEAR))
+    pixels = np.clip(pixels * gain.astype(np.float32), 0, 255).astype(np.uint8)
+    if scaled_size == target_size:
+        return pixels
+    canvas = np.full((target_size[1], target_size[0], 3), LETTERBOX_COLOR, dtype=np.uint8)
+    canvas[offset[1]:offset[1] + scaled_size[1], offset[0]:offset[0] + scaled_size[0]] = pixels
+    return canvas
+
+def augment_batch(batch: List[Tuple[str, str]], augmentation: dict) -> List[Tuple[str, str, str, Tuple[int, int]]]:
+    """
+    Write all augmented copies of a batch of samples next to their image and label files
+
+    batch: list of (image path, label path) of the samples, the random shifts of a sample are seeded by the seed and its file name
+    The bounding boxes of a copy of all samples in the batch are transformed in a single vectorized operation.
+
+    Returns a list of (source image path, image path, label path, size) of the augmented samples
+    """
+    label_paths = [label_path for _, label_path in batch]
+    class_column, boxes, counts = normalize.load_label_files(label_paths)
+    offsets = np.cumsum([0] + counts)
+    images = []
+    rngs = []
+    for image_path, _ in batch:
+        with Image.open(image_path) as img:
+            images.append(np.asarray(img.convert('RGB')))
+        seed = augmentation['seed']
+        rngs.append(np.random.default_rng(None if seed is None else [seed, zlib.crc32(os.path.basename(image_path).encode())]))
+    flippable = [augmentation['flip'] and all(class_id in augmentation['flip_class_ids'] for class_id in class_column[offsets[i]:offsets[i + 1]]) for i in range(len(batch))]
+
+    augmented = []
+    for copy in range(augmentation['copies']):
+        scale = np.empty((len(batch), 2))
+        offset = np.empty((len(batch), 2))
+        flip = np.zeros(len(batch), dtype=bool)
+        for i, ((image_path, label_path), pixels, rng) in enumerate(zip(batch, images, rngs)):
+            source_size = (pixels.shape[1], pixels.shape[0])
+            target_size = tuple(augmentation['sizes'][copy % len(augmentation['sizes'])] or source_size)
+            scaled_size, pixel_offset = letterbox_geometry(source_size, target_size, augmentation['letterbox'])
+            flip[i] = flippable[i] and rng.random() < 0.5
+            gain = (1 + rng.uniform(-augmentation['brightness'], augmentation['brightness'])) \
+                * (1 + rng.uniform(-augmentation['color'], augmentation['color'], 3))
+            output_image_path = augmented_path(image_path, copy)
+            Image.fromarray(transform_image(pixels, target_size, scaled_size, pixel_offset, flip[i], gain)).save(output_image_path, 'JPEG')
+            scale[i] = (scaled_size[0] / target_size[0], scaled_size[1] / target_size[1])
+            offset[i] = (pixel_offset[0] / target_size[0], pixel_offset[1] / target_size[1])
+            augmented.append((image_path, output_image_path, augmented_path(label_path, copy), target_size))
+        line_boxes = transform_boxes(boxes, np.repeat(scale, counts, axis=0), np.repeat(offset, counts, axis=0), np.repeat(flip, counts))
+        normalize.write_label_files([augmented_path(label_path, copy) for label_path in label_paths], class_column, line_boxes, counts)
+    return augmented
+
+def augment_samples(samples: List[Tuple[str, str]], augmentation: dict, workers: int = None, batch_size: int = 64) -> List[Tuple[str, str, str, Tuple[int, int]]]:
+    """
+    Augment placed samples in batches using a pool of worker processes
+
+    samples: list of (image path, normalized label path), the augmented copies are written next to them and stay in the split of their render
+
+    Returns a list of (source image path, image path, label path, size) of the augmented samples
+    """
+    if not samples or augmentation['copies'] < 1:
+        return []
+    batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+    augmented = []
+    with metrics.timed('augment'):
+        if workers == 1 or len(batches) == 1:
+            for result in map(augment_batch, batches, repeat(augmentation)):
+                augmented.extend(result)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(augment_batch, batches, repeat(augmentation)):
+                    augmented.extend(result)
+    metrics.increment('augmented', len(augmented))
+    logging.info("Augmented %i samples into %i samples", len(samples), len(augmented))
+    return augmented
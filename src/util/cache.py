@@ -0,0 +1,187 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import List
+
+from util import manifest
+from util import metrics
+
+# Names of the image and the raw label (in pixels) of a render inside its cache entry
+ENTRY_FILES = ('image.jpg', 'label.txt')
+
+# ioctl request of Linux to share the extents of a file with another file (reflink) on btrfs, xfs and similar
+FICLONE = 0x40049409
+
+def open_cache(folder: str, max_size: int) -> dict:
+    """
+    Open a content-addressed render cache, the folder is created if it doesn't exist
+
+    max_size: maximum size of all cached renders in bytes, the least recently used renders are evicted beyond it
+
+    Returns the cache as dictionary to be passed to the other functions of this module
+    """
+    os.makedirs(folder, exist_ok=True)
+    cache = {'folder': folder, 'max_size': max_size, 'entries': {}, 'size': 0, 'checksums': {}, 'lock': threading.Lock()}
+    scan_entries(cache)
+    logging.info("Opened render cache %s with %i renders (%.1f MB)", folder, len(cache['entries']), cache['size'] / (1 << 20))
+    return cache
+
+def scan_entries(cache: dict) -> None:
+    """
+    Read the last use and size of all cached renders, also picking up renders cached by other processes
+    """
+    entries = {}
+    for entry in os.scandir(cache['folder']):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        try:
+            files = [os.stat(os.path.join(entry.path, name)) for name in os.listdir(entry.path)]
+        except FileNotFoundError:
+            continue
+        entries[entry.name] = (entry.stat().st_mtime, sum(stat.st_size for stat in files))
+    with cache['lock']:
+        cache['entries'] = entries
+        cache['size'] = sum(size for _, size in entries.values())
+
+def app_checksum(cache: dict, app: str) -> str:
+    """
+    Checksum of the generator binary, computed once per cache
+    """
+    with cache['lock']:
+        checksum = cache['checksums'].get(app)
+    if checksum is None:
+        checksum = manifest.file_checksum(app)
+        with cache['lock']:
+            cache['checksums'][app] = checksum
+    return checksum
+
+def render_key(cache: dict, app: str, width: int, height: int, widget_list: List[str], widget_count: int, delay_count: int,
+               layout: str = None, seed: int = None, rerender: int = 0) -> str:
+    """
+    Key of a render, built from the checksum of the generator binary and all parameters the render depends on
+
+    The generator has no seed argument and renders differently on every run, so renders with equal parameters
+    are told apart by their seed (the number of the render) and rerender (the attempt after rejected renders).
+    """
+    parameters = {
+        'app': app_checksum(cache, app),
+        'width': width,
+        'height': height,
+        'widgets': list(widget_list),
+        'widget_count': widget_count,
+        'delay_count': delay_count,
+        'layout': layout,
+        'seed': seed,
+        'rerender': rerender,
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+def link_file(source: str, destination: str) -> None:
+    """
+    Link a file to a new path without copying its content if possible
+
+    Tries a hardlink, a reflink (if source and destination are on different file systems) and a copy in this order.
+    Hardlinked files share their content with the cache, so they must be replaced instead of written in place.
+    """
+    try:
+        os.link(source, destination)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(source, destination)
+
+def lookup(cache: dict, key: str, image_path: str) -> bool:
+    """
+    Serve a cached render by linking its image and label to image_path and the label path next to it
+
+    Returns True if the render was cached
+    """
+    entry_folder = os.path.join(cache['folder'], key)
+    output_files = [image_path, image_path.replace('.jpg', '.txt')]
+    if not os.path.isdir(entry_folder):
+        metrics.increment('cache_misses')
+        return False
+    with metrics.timed('cache'):
+        try:
+            for name, output_file in zip(ENTRY_FILES, output_files):
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                link_file(os.path.join(entry_folder, name), output_file)
+        except FileNotFoundError:
+            for output_file in output_files:
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+            metrics.increment('cache_misses')
+            return False
+        try:
+            os.utime(entry_folder)
+        except FileNotFoundError:
+            pass
+    with cache['lock']:
+        if key in cache['entries']:
+            cache['entries'][key] = (os.path.getmtime(entry_folder) if os.path.exists(entry_folder) else 0, cache['entries'][key][1])
+    metrics.increment('cache_hits')
+    return True
+
+def store(cache: dict, key: str, image_path: str) -> None:
+    """
+    Add the image and label of a finished render to the cache and evict the least recently used renders beyond the maximum size
+
+    The entry is assembled in a temporary folder and renamed into place, so concurrent processes never see a partial entry.
+    """
+    entry_folder = os.path.join(cache['folder'], key)
+    if os.path.exists(entry_folder):
+        return
+    files = [image_path, image_path.replace('.jpg', '.txt')]
+    with metrics.timed('cache'):
+        temporary_folder = tempfile.mkdtemp(prefix='.', dir=cache['folder'])
+        try:
+            for name, file in zip(ENTRY_FILES, files):
+                link_file(file, os.path.join(temporary_folder, name))
+            size = sum(os.path.getsize(file) for file in files)
+            os.rename(temporary_folder, entry_folder)
+        except OSError as e:
+            shutil.rmtree(temporary_folder, ignore_errors=True)
+            if os.path.exists(entry_folder):
+                return
+            logging.warning("Failed to cache render %s: %s", key, e)
+            return
+    with cache['lock']:
+        cache['entries'][key] = (os.path.getmtime(entry_folder), size)
+        cache['size'] += size
+        over_limit = cache['size'] > cache['max_size']
+    if over_limit:
+        evict(cache)
+
+def evict(cache: dict, low_water: float = 0.9) -> None:
+    """
+    Remove the least recently used renders until the cache fits into a fraction (low_water) of its maximum size
+
+    Evicting below the maximum size leaves room for further renders before the cache has to be scanned again.
+    """
+    scan_entries(cache)
+    with cache['lock']:
+        evicted = []
+        for key, (_, size) in sorted(cache['entries'].items(), key=lambda item: item[1][0]):
+            if cache['size'] <= cache['max_size'] * low_water:
+                break
+            del cache['entries'][key]
+            cache['size'] -= size
+            evicted.append(key)
+    for key in evicted:
+        shutil.rmtree(os.path.join(cache['folder'], key), ignore_errors=True)
+    metrics.increment('cache_evictions', len(evicted))
+    logging.debug("Evicted %i renders from the cache", len(evicted))
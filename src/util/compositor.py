@@ -0,0 +1,153 @@
+import os
+import glob
+import logging
+import yaml
+import numpy as np
+from PIL import Image
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from util import manifest
+from util import cache
+
+# Crops of the worker processes, set once per process by init_worker()
+_worker_crops = None
+
+def crop_box(pixels: np.ndarray, x: float, y: float, w: float, h: float) -> np.ndarray:
+    """
+    Crop a bounding box in pixels (center x, center y, width, height) out of an image array
+    """
+    left, top = max(0, round(x - w / 2)), max(0, round(y - h / 2))
+    right, bottom = min(pixels.shape[1], round(x + w / 2)), min(pixels.shape[0], round(y + h / 2))
+    return pixels[top:bottom, left:right].copy()
+
+def background_color(pixels: np.ndarray) -> np.ndarray:
+    """
+    Background color of a render, the median color of its border pixels
+    """
+    border = np.concatenate((pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]))
+    return np.median(border, axis=0).astype(np.uint8)
+
+def load_dataset_crops(dataset_folder: str, class_names: List[str]) -> Dict[str, list]:
+    """
+    Load the widgets of all single-widget samples of a dataset as crops
+
+    The class names of the dataset are read from its yaml file, widgets of other classes than class_names are skipped.
+
+    Returns a dictionary in the format: {split: [(class_name, crop, background color)]}
+    """
+    yaml_files = glob.glob(os.path.join(dataset_folder, '*.yaml'))
+    if not yaml_files:
+        raise ValueError(f"No dataset yaml file in {dataset_folder}")
+    with open(yaml_files[0], 'r') as f:
+        names = {str(class_id): class_name for class_id, class_name in yaml.safe_load(f)['names'].items()}
+    crops = {}
+    for record in manifest.read_manifest(manifest.manifest_path(dataset_folder)):
+        if 'shard' in record:
+            continue
+        with open(os.path.join(dataset_folder, record['label']), 'r') as f:
+            lines = [line.split() for line in f if line.strip()]
+        if len(lines) != 1 or names.get(lines[0][0]) not in class_names:
+            continue
+        with Image.open(os.path.join(dataset_folder, record['image'])) as img:
+            pixels = np.asarray(img.convert('RGB'))
+        height, width = pixels.shape[:2]
+        x, y, w, h = (float(value) for value in lines[0][1:5])
+        crop = crop_box(pixels, x * width, y * height, w * width, h * height)
+        if crop.size:
+            crops.setdefault(record['split'], []).append((names[lines[0][0]], crop, background_color(pixels)))
+    return crops
+
+def load_cache_crops(cache_folder: str, class_names: List[str]) -> List[tuple]:
+    """
+    Load the widgets of all cached single-widget renders as crops, the labels of the render cache are in pixels with class names
+
+    Returns a list of (class_name, crop, background color)
+    """
+    crops = []
+    for entry in os.scandir(cache_folder):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        image_name, label_name = cache.ENTRY_FILES
+        try:
+            with open(os.path.join(entry.path, label_name), 'r') as f:
+                lines = [line.split() for line in f if line.strip()]
+            if len(lines) != 1 or lines[0][0] not in class_names:
+                continue
+            with Image.open(os.path.join(entry.path, image_name)) as img:
+                pixels = np.asarray(img.convert('RGB'))
+        except FileNotFoundError:
+            # Evicted while loading
+            continue
+        crop = crop_box(pixels, *(float(value) for value in lines[0][1:5]))
+        if crop.size:
+            crops.append((lines[0][0], crop, background_color(pixels)))
+    return crops
+
+def free_positions(occupied: np.ndarray, rows: int, columns: int) -> np.ndarray:
+    """
+    Top left cells of all free windows of rows x columns cells in an occupancy grid
+
+    All windows are checked at once using a summed-area table of the grid
+
+    Returns an array of flat indices into a grid of shape (grid rows - rows + 1, grid columns - columns + 1)
+    """
+    table = np.zeros((occupied.shape[0] + 1, occupied.shape[1] + 1), dtype=np.int32)
+    table[1:, 1:] = occupied.cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
+    windows = table[rows:, columns:] - table[:-rows, columns:] - table[rows:, :-columns] + table[:-rows, :-columns]
+    return np.flatnonzero(windows == 0)
+
+def compose_scene(crops: List[tuple], widget_count: int, width: int, height: int, rng: np.random.Generator,
+                  cell_size: int = 4, margin: int = 1) -> Tuple[np.ndarray, List[Tuple[str, float, float, float, float]]]:
+    """
+    Paste widget_count randomly chosen crops onto a canvas without overlaps
+
+    Free positions are searched in an occupancy grid of cell_size pixels, crops keep margin cells of distance to each other.
+    Larger crops are placed first, crops without a free position are left out.
+
+    Returns the canvas and the boxes of the placed crops as (class_name, x, y, w, h) normalized to the canvas size
+    """
+    chosen = [crops[i] for i in rng.integers(0, len(crops), widget_count)]
+    chosen.sort(key=lambda crop: crop[1].shape[0] * crop[1].shape[1], reverse=True)
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[:] = chosen[0][2] if chosen else 255
+    occupied = np.zeros((height // cell_size, width // cell_size), dtype=bool)
+    boxes = []
+    for class_name, crop, _ in chosen:
+        crop_height, crop_width = crop.shape[:2]
+        rows, columns = -(-crop_height // cell_size), -(-crop_width // cell_size)
+        if rows > occupied.shape[0] or columns > occupied.shape[1]:
+            continue
+        positions = free_positions(occupied, rows, columns)
+        if not positions.size:
+            continue
+        row, column = divmod(int(rng.choice(positions)), occupied.shape[1] - columns + 1)
+        top, left = row * cell_size, column * cell_size
+        canvas[top:top + crop_height, left:left + crop_width] = crop
+        occupied[max(0, row - margin):row + rows + margin, max(0, column - margin):column + columns + margin] = True
+        boxes.append((class_name, (left + crop_width / 2) / width, (top + crop_height / 2) / height, crop_width / width, crop_height / height))
+    return canvas, boxes
+
+def init_worker(crops: Dict[str, list]) -> None:
+    global _worker_crops
+    _worker_crops = crops
+
+def compose_batch(batch: List[dict], width: int, height: int, class_ids: Dict[str, str], seed: int = None) -> List[Tuple[dict, list]]:
+    """
+    Compose and write the scenes of a batch of jobs using the crops of the worker process
+
+    Every job has the index, split, widget count and image and label path of its scene, the crops are taken from the split of the job.
+
+    Returns a list of (job, boxes as (class_name, x, y, w, h)) of the written scenes
+    """
+    written = []
+    for job in batch:
+        rng = np.random.default_rng(None if seed is None else [seed, job['index']])
+        canvas, boxes = compose_scene(_worker_crops[job['split']], job['widget_count'], width, height, rng)
+        Image.fromarray(canvas).save(job['image_path'], 'JPEG')
+        with open(job['label_path'], 'w') as f:
+            f.writelines(f"{class_ids[class_name]} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for class_name, x, y, w, h in boxes)
+        written.append((job, boxes))
+    logging.debug("Composed %i scenes", len(written))
+    return written
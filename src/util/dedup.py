@@ -0,0 +1,81 @@
+import os
+import threading
+import logging
+import numpy as np
+from PIL import Image
+
+INDEX_FILE = 'dedup_index.npy'
+
+# Amount of set bits for every byte value, used if numpy lacks bitwise_count (numpy < 2.0)
+_popcount_table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def dhash(image_path: str, hash_size: int = 8) -> np.uint64:
+    """
+    Difference hash of an image
+
+    The image is downscaled to (hash_size + 1) x hash_size gray pixels and every bit tells if a pixel is brighter than its right neighbour
+    """
+    with Image.open(image_path) as img:
+        pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64)
+
+def hamming_distances(hashes: np.ndarray, value: np.uint64) -> np.ndarray:
+    """
+    Hamming distances between an array of hashes and a single hash
+    """
+    xor = np.bitwise_xor(hashes, value)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return _popcount_table[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def load_index(path: str) -> dict:
+    """
+    Load a persistent index of image hashes, an empty index is created if the file doesn't exist
+
+    Returns the index as dictionary to be passed to the other functions of this module
+    """
+    hashes = np.load(path) if os.path.exists(path) else np.empty(0, dtype=np.uint64)
+    capacity = max(1024, 2 * len(hashes))
+    buffer = np.empty(capacity, dtype=np.uint64)
+    buffer[:len(hashes)] = hashes
+    logging.debug("Loaded %i hashes from %s", len(hashes), path)
+    return {'path': path, 'hashes': buffer, 'count': len(hashes), 'unsaved': 0, 'lock': threading.Lock()}
+
+def save_index(index: dict) -> None:
+    """
+    Atomically write the hashes of an index into its file
+    """
+    with index['lock']:
+        temporary_path = index['path'] + '.tmp.npy'
+        np.save(temporary_path, index['hashes'][:index['count']])
+        os.replace(temporary_path, index['path'])
+        index['unsaved'] = 0
+
+def add_if_unique(index: dict, value: np.uint64, threshold: int, save_interval: int = 1000) -> bool:
+    """
+    Add a hash to the index unless a hash within the Hamming distance threshold is already known
+
+    The index is saved every save_interval added hashes
+
+    Returns True if the hash was added
+    """
+    with index['lock']:
+        count = index['count']
+        if count and hamming_distances(index['hashes'][:count], value).min() <= threshold:
+            return False
+        if count == len(index['hashes']):
+            index['hashes'] = np.concatenate((index['hashes'], np.empty(count, dtype=np.uint64)))
+        index['hashes'][count] = value
+        index['count'] += 1
+        index['unsaved'] += 1
+        save = index['unsaved'] >= save_interval
+    if save:
+        save_index(index)
+    return True
+
+def is_unique_image(index: dict, image_path: str, threshold: int) -> bool:
+    """
+    Check an image against the index and add its hash if it isn't a near-duplicate of a known image
+    """
+    return add_if_unique(index, dhash(image_path), threshold)
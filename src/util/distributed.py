@@ -0,0 +1,81 @@
+import os
+import json
+import hashlib
+import logging
+from typing import List
+
+from util import manifest
+from util import shards
+
+def derive_seed(base_seed: int, part: int) -> int:
+    """
+    Derive a reproducible 32 bit seed for a part of a job from the seed of the job
+    """
+    digest = hashlib.sha256(f"{base_seed}:{part}".encode()).digest()
+    return int.from_bytes(digest[:4], 'big')
+
+def plan_parts(iterations: int, parts: int, base_seed: int) -> List[dict]:
+    """
+    Split a job of iterations renders into parts (shards) with disjoint index ranges and their own seeds
+
+    Returns a list of dictionaries with part number, start index, amount of iterations and seed of every part
+    """
+    if parts < 1:
+        raise ValueError("A job needs at least one part")
+    plan = []
+    start = 0
+    for part in range(parts):
+        part_iterations = iterations // parts + (1 if part < iterations % parts else 0)
+        plan.append({'part': part, 'start': start, 'iterations': part_iterations, 'seed': derive_seed(base_seed, part)})
+        start += part_iterations
+    return plan
+
+def part_folder(output_folder: str, part: int) -> str:
+    """
+    Output folder of a part of a job
+    """
+    return os.path.join(output_folder, f"part_{part:04d}")
+
+def write_plan(path: str, argv: List[str], output_folder: str, dataset_name: str, parts: List[dict], seed: int = None, iterations: int = None) -> None:
+    """
+    Write the plan of a job, argv are the command line arguments of the randomizer shared by all parts
+
+    seed and iterations of the whole job are kept, so every part can take its slice of the splits of the whole job
+    """
+    with open(path, 'w') as f:
+        json.dump({'argv': argv, 'output_folder': output_folder, 'dataset_name': dataset_name, 'seed': seed, 'iterations': iterations, 'parts': parts}, f, indent=4)
+
+def read_plan(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def merge_parts(output_folder: str, dataset_name: str, part_folders: List[str], splits: List[str]) -> dict:
+    """
+    Merge the datasets of all parts of a job into a single dataset without copying any sample
+
+    The merged dataset folder gets a manifest with all records, paths in it are relative to the merged dataset folder.
+
+    Returns a dictionary in the format: {split: (absolute image paths, tar shard paths relative to the merged dataset folder)}
+    """
+    merged_folder = os.path.join(output_folder, dataset_name)
+    os.makedirs(merged_folder, exist_ok=True)
+    sources = {split: ([], []) for split in splits}
+    output_files = {}
+    with manifest.open_manifest(manifest.manifest_path(merged_folder), append=False) as merged_manifest:
+        for folder in part_folders:
+            dataset_folder = os.path.join(folder, dataset_name)
+            for record in manifest.read_manifest(manifest.manifest_path(dataset_folder)):
+                if record['output_file'] in output_files:
+                    raise ValueError(f"Name collision of {record['output_file']} in {folder} and {output_files[record['output_file']]}")
+                output_files[record['output_file']] = folder
+                if 'shard' in record:
+                    record = dict(record, shard=os.path.relpath(os.path.join(dataset_folder, 'shards', record['shard']), merged_folder))
+                else:
+                    sources[record['split']][0].append(os.path.join(dataset_folder, record['image']))
+                    record = dict(record, image=os.path.relpath(os.path.join(dataset_folder, record['image']), merged_folder),
+                                  label=os.path.relpath(os.path.join(dataset_folder, record['label']), merged_folder))
+                manifest.write_record(merged_manifest, record)
+            for split in splits:
+                sources[split][1].extend(os.path.relpath(shard, merged_folder) for shard in shards.shard_files(os.path.join(dataset_folder, 'shards'), split))
+    logging.info("Merged %i samples of %i parts", len(output_files), len(part_folders))
+    return sources
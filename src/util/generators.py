@@ -3,6 +3,8 @@ from typing import List
 from typing import Generator
 import logging
 
+from util import manifest
+
 def dataset_files_in_dir(dir: str, skip_directories: List[str], skip_files: List[str]) -> Generator[str, None, None]:
     """
     Generator for dataset files in a directory
@@ -23,13 +25,34 @@ def dataset_files_in_dir(dir: str, skip_directories: List[str], skip_files: List
                 logging.debug("Found %s", file)
                 yield os.path.join(root, file)
 
+def manifest_of_dir(directory: str) -> tuple:
+    """
+    Manifest covering the label files of a directory, either the dataset folder itself or a label folder of a split (<dataset>/labels/<split>)
+
+    Returns the manifest file and the splits to read from it (None for all splits), or (None, None) if the directory has no manifest
+    """
+    directory = os.path.abspath(directory)
+    if os.path.exists(manifest.manifest_path(directory)):
+        return manifest.manifest_path(directory), None
+    labels_folder, split = os.path.split(directory)
+    dataset_folder, labels_name = os.path.split(labels_folder)
+    if labels_name == 'labels' and os.path.exists(manifest.manifest_path(dataset_folder)):
+        return manifest.manifest_path(dataset_folder), [split]
+    return None, None
+
 def annotation_files_in_dirs(target_directories: List[str]) -> Generator[str, None, None]:
     """
     Generator for label files in the provided directories
 
+    Label files of datasets with a manifest are read from it (see manifest_of_dir()) instead of walking the directory
+
     Returns a generator of absolute file paths to the annotation files
     """
     for directory in target_directories:
+        manifest_file, splits = manifest_of_dir(directory)
+        if manifest_file is not None:
+            yield from annotation_files_in_manifest(manifest_file, splits)
+            continue
         for root, dirs, files in os.walk(directory):
             for file in files:
                 if file.endswith('.txt'):
@@ -52,4 +75,19 @@ def annotation_files_in_dir(dir: str, skip_directories: List[str], skip_files: L
                 continue
             if file.endswith('.txt'):
                 logging.debug("Found %s", file)
-                yield os.path.join(root, file)
\ No newline at end of file
+                yield os.path.join(root, file)
+
+def annotation_files_in_manifest(manifest_file: str, splits: List[str] = None) -> Generator[str, None, None]:
+    """
+    Generator for label files recorded in a dataset manifest
+
+    Only yields label files of the provided splits if splits is set, samples packed into shards are skipped
+
+    Returns a generator of absolute file paths to the annotation files
+    """
+    dataset_folder = os.path.dirname(os.path.abspath(manifest_file))
+    for record in manifest.read_manifest(manifest_file):
+        if 'shard' in record:
+            continue
+        if splits is None or record['split'] in splits:
+            yield os.path.join(dataset_folder, record['label'])
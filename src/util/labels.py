@@ -0,0 +1,96 @@
+import os
+import tempfile
+from typing import List
+from typing import Dict
+from typing import Iterable
+from typing import Generator
+import logging
+
+from util import generators
+from util import normalize
+
+def class_id_map(class_names: List[str]) -> Dict[str, str]:
+    """
+    Create a dictionary mapping class names to their id
+
+    The id is the index of the class name in class_names
+    """
+    return {class_name: str(i) for i, class_name in enumerate(class_names)}
+
+def count_classes(file: str) -> Dict[str, int]:
+    """
+    Count the instances per class name (first token of every line) of a label file
+    """
+    counts = {}
+    with open(file, 'r') as f:
+        for line in f:
+            tokens = line.split(maxsplit=1)
+            if tokens:
+                counts[tokens[0]] = counts.get(tokens[0], 0) + 1
+    return counts
+
+def fix_label_line(line: str, class_ids: Dict[str, str], img_width: int, img_height: int) -> str:
+    """
+    Replace the class name of a label line with its id and normalize the bounding box
+
+    Expecting the line to be in YOLO format with pixel values: <class_name> <x> <y> <width> <height>
+
+    Returns None for invalid lines
+    """
+    tokens = line.split()
+    if len(tokens) < 5:
+        return None
+    class_id = class_ids.get(tokens[0])
+    if class_id is None:
+        logging.error("Unknown class %s", tokens[0])
+        class_id = tokens[0]
+    bbox = normalize.normalize_bbox(tokens[1:5], img_width, img_height)
+    return f"{class_id} {' '.join(bbox)}\n"
+
+def fix_label_lines(lines: Iterable[str], class_ids: Dict[str, str], img_width: int, img_height: int, file: str = None) -> Generator[str, None, None]:
+    """
+    Generator for the fixed lines of a label file, invalid lines are logged and skipped
+    """
+    for i, line in enumerate(lines):
+        fixed_line = fix_label_line(line, class_ids, img_width, img_height)
+        if fixed_line is None:
+            logging.error("Invalid line #%i in %s: %s", i, file, line.rstrip('\n'))
+            continue
+        yield fixed_line
+
+def read_fixed_label(file: str, class_ids: Dict[str, str], img_width: int, img_height: int) -> str:
+    """
+    Read a label file with class ids and normalized bounding boxes without rewriting it
+    """
+    with open(file, 'r') as f:
+        return ''.join(fix_label_lines(f, class_ids, img_width, img_height, file))
+
+def fix_label_file(file: str, class_ids: Dict[str, str], img_width: int, img_height: int, output_file: str = None) -> None:
+    """
+    Rewrite a label file with class ids and normalized bounding boxes in a single pass
+
+    The file is read once and written once into a temporary file, which atomically replaces the original file
+    (or output_file if provided, the original file is left untouched in that case).
+    Class names are matched against whole tokens, so names containing other class names aren't mangled.
+    """
+    if output_file is None:
+        output_file = file
+    directory = os.path.dirname(output_file)
+    with open(file, 'r') as src, tempfile.NamedTemporaryFile('w', dir=directory, prefix='.', suffix='.tmp', delete=False) as dst:
+        try:
+            dst.writelines(fix_label_lines(src, class_ids, img_width, img_height, file))
+        except BaseException:
+            dst.close()
+            os.remove(dst.name)
+            raise
+    os.chmod(dst.name, os.stat(file).st_mode)
+    os.replace(dst.name, output_file)
+
+def fix_label_files_in_dirs(class_names: List[str], img_width: int, img_height: int, target_directories: List[str]) -> None:
+    """
+    Recursively replace class names with ids and normalize bounding boxes of all label files in the provided directories
+    """
+    class_ids = class_id_map(class_names)
+    for file in generators.annotation_files_in_dirs(target_directories):
+        logging.debug(f"Fixing labels in {file}...")
+        fix_label_file(file, class_ids, img_width, img_height)
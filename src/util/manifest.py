@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+import logging
+from typing import IO
+from typing import Generator
+
+MANIFEST_FILE = 'manifest.jsonl'
+
+def manifest_path(dataset_folder: str) -> str:
+    """
+    Path of the manifest file of a dataset
+    """
+    return os.path.join(dataset_folder, MANIFEST_FILE)
+
+def file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 checksum of a file as hex string
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def read_manifest(path: str) -> Generator[dict, None, None]:
+    """
+    Generator for the records of a manifest file
+
+    A truncated last line (e.g. after a crash while writing) is skipped
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning("Skipping invalid record #%i in %s", i, path)
+
+def open_manifest(path: str, append: bool = True) -> IO:
+    """
+    Open a manifest file for writing records, existing records are kept if append is set
+    """
+    return open(path, 'a' if append else 'w', buffering=1)
+
+def write_record(manifest: IO, record: dict) -> None:
+    """
+    Append a record to an open manifest file
+
+    The record is flushed right away, so it survives a crash of the run
+    """
+    manifest.write(json.dumps(record, separators=(',', ':')) + '\n')
+    manifest.flush()
+
+def sample_record(job: dict, dataset_folder: str, image_path: str, label_path: str, **parameters) -> dict:
+    """
+    Create the manifest record of a placed sample
+
+    Paths are stored relative to the dataset folder
+    """
+    return {
+        'index': job['index'],
+        'output_file': job['output_file'],
+        'widgets': job['widgets'],
+        'split': job['split'],
+        'image': os.path.relpath(image_path, dataset_folder),
+        'label': os.path.relpath(label_path, dataset_folder),
+        'sha256': file_checksum(image_path),
+        **parameters
+    }
@@ -0,0 +1,84 @@
+import itertools
+import yaml
+from typing import List
+
+# Keys of a job entry which may hold a list of values, every combination of their values is a group of the matrix
+MATRIX_KEYS = ('widget_types', 'size', 'widget_count', 'layout', 'delay_count', 'iterations')
+
+DEFAULTS = {
+    'size': '250x250',
+    'widget_count': 1,
+    'layout': None,
+    'delay_count': 10,
+    'iterations': 10,
+    'split_widgets': False,
+}
+
+def load_matrix(path: str) -> dict:
+    """
+    Load a run matrix from a YAML file
+    """
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f)
+    if not isinstance(config, dict) or not config.get('jobs'):
+        raise ValueError(f"Run matrix {path} has no jobs")
+    return config
+
+def parse_size(value: str) -> tuple:
+    """
+    Parse a size in the format WIDTHxHEIGHT (e.g. 250x250)
+    """
+    width, _, height = str(value).partition('x')
+    if not width.isdigit() or not height.isdigit():
+        raise ValueError(f"Invalid size {value}, expected WIDTHxHEIGHT")
+    return int(width), int(height)
+
+def matrix_values(key: str, value) -> list:
+    """
+    Values of a key of a job entry, a single value is a list of one value
+
+    widget_types is a list of widgets or a list of such lists
+    """
+    if key == 'widget_types':
+        if all(isinstance(widget, str) for widget in value):
+            return [list(value)]
+        return [list(widgets) for widgets in value]
+    return list(value) if isinstance(value, list) else [value]
+
+def group_name(group: dict) -> str:
+    """
+    Name of the sub-dataset of a group built from its parameters (e.g. button-label_grid_250x250_3)
+    """
+    return f"{'-'.join(group['widget_types'])}_{group['layout'] or 'none'}_{group['width']}x{group['height']}_{group['widget_count']}"
+
+def expand_matrix(config: dict) -> List[dict]:
+    """
+    Expand the job entries of a run matrix into groups
+
+    Every job entry is combined with the defaults of the matrix (config['defaults']), keys listed in MATRIX_KEYS may hold a list of values.
+    Groups go into the dataset of their entry, the dataset of the matrix (config['dataset']) or, if config['sub_datasets'] is set,
+    a sub-dataset named after their parameters.
+
+    Returns a list of dictionaries with dataset, widget_types, width, height, widget_count, layout, delay_count, iterations and split_widgets
+    """
+    defaults = dict(DEFAULTS, **config.get('defaults', {}))
+    groups = []
+    for entry in config['jobs']:
+        entry = dict(defaults, **entry)
+        if 'widget_types' not in entry:
+            raise ValueError(f"Job {entry} has no widget_types")
+        axes = [matrix_values(key, entry[key]) for key in MATRIX_KEYS]
+        for values in itertools.product(*axes):
+            group = dict(zip(MATRIX_KEYS, values))
+            group['width'], group['height'] = parse_size(group.pop('size'))
+            if group['layout'] == 'none':
+                group['layout'] = None
+            group['split_widgets'] = bool(entry['split_widgets'])
+            if 'dataset' in entry:
+                group['dataset'] = entry['dataset']
+            elif config.get('sub_datasets', False):
+                group['dataset'] = group_name(group)
+            else:
+                group['dataset'] = config.get('dataset', 'custom')
+            groups.append(group)
+    return groups
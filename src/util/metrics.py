@@ -0,0 +1,128 @@
+import sys
+import time
+import json
+import threading
+import contextlib
+from typing import Dict
+from typing import List
+
+# Global registry of the current run, shared by all modules like the logging configuration
+_lock = threading.Lock()
+_latencies: Dict[str, List[float]] = {}
+_counters: Dict[str, int] = {}
+_start = time.monotonic()
+
+def reset() -> None:
+    """
+    Clear all recorded latencies and counters and restart the run clock
+    """
+    global _start
+    with _lock:
+        _latencies.clear()
+        _counters.clear()
+        _start = time.monotonic()
+
+def observe(stage: str, seconds: float) -> None:
+    """
+    Record the latency of a single execution of a stage
+    """
+    with _lock:
+        _latencies.setdefault(stage, []).append(seconds)
+
+def increment(counter: str, amount: int = 1) -> None:
+    """
+    Increment a counter of the run
+    """
+    with _lock:
+        _counters[counter] = _counters.get(counter, 0) + amount
+
+def counter(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+@contextlib.contextmanager
+def timed(stage: str):
+    """
+    Context manager recording the latency of the enclosed block for a stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summary() -> dict:
+    """
+    Summary of the run with count, total, mean, p50, p95 and max latency per stage and all counters
+    """
+    with _lock:
+        stages = {}
+        for stage, latencies in _latencies.items():
+            values = sorted(latencies)
+            stages[stage] = {
+                'count': len(values),
+                'total': sum(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'max': values[-1],
+            }
+        return {'elapsed': time.monotonic() - _start, 'stages': stages, 'counters': dict(_counters)}
+
+def write_json_report(path: str, include_latencies: bool = False) -> None:
+    """
+    Write the summary of the run (and all per-sample latencies if include_latencies is set) as JSON
+    """
+    report = summary()
+    if include_latencies:
+        with _lock:
+            report['latencies'] = {stage: list(latencies) for stage, latencies in _latencies.items()}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+
+def write_prometheus_textfile(path: str, prefix: str = 'ui_randomizer') -> None:
+    """
+    Write the summary of the run in the Prometheus textfile format (e.g. for the node exporter textfile collector)
+    """
+    report = summary()
+    lines = [
+        f"# TYPE {prefix}_elapsed_seconds gauge",
+        f"{prefix}_elapsed_seconds {report['elapsed']}",
+        f"# TYPE {prefix}_stage_seconds summary",
+    ]
+    for stage, values in report['stages'].items():
+        lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.5"}} {values["p50"]}')
+        lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.95"}} {values["p95"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {values["total"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    for name, value in report['counters'].items():
+        lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def write_report(path: str) -> None:
+    """
+    Write the metrics report of the run, in Prometheus textfile format for .prom files and as JSON otherwise
+    """
+    if path.endswith('.prom'):
+        write_prometheus_textfile(path)
+    else:
+        write_json_report(path, include_latencies=True)
+
+def print_progress(done: int, total: int, stream=sys.stderr) -> None:
+    """
+    Print a live progress line with throughput and estimated remaining time
+    """
+    elapsed = time.monotonic() - _start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else 0.0
+    stream.write(f"\r[{done}/{total}] {rate:.1f} samples/s, ETA {int(eta // 60):02d}:{int(eta % 60):02d}")
+    if done >= total:
+        stream.write('\n')
+    stream.flush()
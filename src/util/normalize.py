@@ -1,9 +1,15 @@
 import os
+import io
+import shutil
+from typing import Dict
 from typing import List
+from typing import Tuple
 from typing import Generator
 import logging
+import numpy as np
 
 from util import generators
+from util import metrics
 
 def normalize_bbox(bbox: List[str], img_width: int, img_height: int) -> List[str]:
     """
@@ -28,7 +34,7 @@ def normalize_bbox_in_label_file(file: str, img_width: int, img_height: int) ->
 
     Expecting lines of the file to be in YOLO format: <class_id> <x> <y> <width> <height>
     """
-    with open(file, 'r+') as f:
+    with metrics.timed('normalize'), open(file, 'r+') as f:
         lines = f.readlines()
         for i, line in enumerate(lines):
             line = line.split(' ')
@@ -60,25 +66,134 @@ def annotation_files(dir: str, skip_directories: List[str], skip_files: List[str
                 logging.debug("Found %s", file)
                 yield os.path.join(root, file)
 
-def normalize_bbox_in_label_files_of_dir(root: str, img_width: int, img_height: int, skip_directories: List[str] = ['rico'], skip_files: List[str] = ['test.txt', 'train.txt', 'val.txt']) -> None:
+def load_label_files(files: List[str], invalid_lines: Dict[int, List[str]] = None) -> Tuple[List[str], np.ndarray, List[int]]:
     """
-    Recursively normalize all bounding boxes in a dataset directory
+    Load the bounding boxes of multiple label files into a single array
 
-    Skips by default directories named 'rico' and files named 'test.txt', 'train.txt', and 'val.txt'
+    Expecting lines of the files to be in YOLO format: <class_id> <x> <y> <width> <height>
+    invalid_lines: collects the invalid lines of every file by its position in files, so they can be written back unchanged
+
+    Returns the class column of all lines, an array of shape (lines, 4) with the bounding boxes
+    and the amount of lines per file
+    """
+    class_column = []
+    values = []
+    counts = []
+    for file in files:
+        count = 0
+        with open(file, 'r') as f:
+            for i, line in enumerate(f):
+                tokens = line.split()
+                if len(tokens) < 5:
+                    if tokens:
+                        logging.error("Invalid line #%i in %s: %s", i, file, line.rstrip('\n'))
+                        metrics.increment('invalid_lines')
+                        if invalid_lines is not None:
+                            invalid_lines.setdefault(len(counts), []).append(line.rstrip('\n') + '\n')
+                    continue
+                class_column.append(tokens[0])
+                values.append(tokens[1:5])
+                count += 1
+        counts.append(count)
+    boxes = np.array(values, dtype=np.float64).reshape(-1, 4)
+    return class_column, boxes, counts
+
+def normalize_bbox_array(boxes: np.ndarray, img_width: int, img_height: int, clamp: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normalize an array of YOLO bounding boxes in pixels to be between 0 and 1
+
+    Boxes reaching outside of the image are clamped to the image borders if clamp is set
+
+    Returns the normalized boxes and a boolean mask of the boxes which were out of bounds
+    """
+    boxes = boxes / np.array([img_width, img_height, img_width, img_height], dtype=np.float64)
+    corners = np.concatenate((boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2), axis=1)
+    out_of_bounds = ((corners < 0) | (corners > 1)).any(axis=1)
+    if clamp and out_of_bounds.any():
+        corners = np.clip(corners, 0, 1)
+        boxes = np.concatenate(((corners[:, :2] + corners[:, 2:]) / 2, corners[:, 2:] - corners[:, :2]), axis=1)
+    return boxes, out_of_bounds
+
+def write_label_files(files: List[str], class_column: List[str], boxes: np.ndarray, counts: List[int], precision: int = 6,
+                      invalid_lines: Dict[int, List[str]] = None) -> None:
+    """
+    Write bounding boxes back into their label files using a fixed float precision
+
+    Counterpart to load_label_files(), invalid lines collected by it are appended unchanged.
+    Every file is written into a temporary file which atomically replaces it, so a crash can't leave truncated label files.
+    """
+    buffer = io.StringIO()
+    np.savetxt(buffer, boxes, fmt=f"%.{precision}f")
+    lines = buffer.getvalue().splitlines()
+    start = 0
+    for i, (file, count) in enumerate(zip(files, counts)):
+        temporary_path = file + '.tmp'
+        with open(temporary_path, 'w') as f:
+            f.writelines(f"{class_column[line]} {lines[line]}\n" for line in range(start, start + count))
+            if invalid_lines is not None:
+                f.writelines(invalid_lines.get(i, []))
+        if os.path.exists(file):
+            shutil.copymode(file, temporary_path)
+        os.replace(temporary_path, file)
+        start += count
+
+def normalize_bbox_in_label_files(files: List[str], img_width: int, img_height: int, precision: int = 6, clamp: bool = True) -> int:
+    """
+    Normalize all bounding boxes of multiple label files with a single vectorized operation
+
+    Returns the amount of bounding boxes which were out of bounds
+    """
+    with metrics.timed('normalize'):
+        invalid_lines = {}
+        class_column, boxes, counts = load_label_files(files, invalid_lines)
+        boxes, out_of_bounds = normalize_bbox_array(boxes, img_width, img_height, clamp)
+        if out_of_bounds.any():
+            file_index = np.repeat(np.arange(len(files)), counts)
+            for i in np.unique(file_index[out_of_bounds]):
+                logging.warning("Bounding boxes out of bounds in %s%s", files[i], " (clamped)" if clamp else "")
+        write_label_files(files, class_column, boxes, counts, precision, invalid_lines)
+    metrics.increment('out_of_bounds', int(out_of_bounds.sum()))
+    return int(out_of_bounds.sum())
+
+def normalize_bbox_in_label_files_batched(files: Generator[str, None, None], img_width: int, img_height: int,
+                                          batch_size: int = 10000, precision: int = 6, clamp: bool = True) -> int:
+    """
+    Normalize all bounding boxes of the label files in batches of batch_size files
+
+    Returns the amount of bounding boxes which were out of bounds
     """
-    for file in annotation_files(root, skip_directories, skip_files):
-        logging.debug(f"Normalizing {file}...")
-        normalize_bbox_in_label_file(root, file, img_width, img_height)
+    out_of_bounds = 0
+    batch = []
+    for file in files:
+        batch.append(file)
+        if len(batch) >= batch_size:
+            out_of_bounds += normalize_bbox_in_label_files(batch, img_width, img_height, precision, clamp)
+            batch = []
+    if batch:
+        out_of_bounds += normalize_bbox_in_label_files(batch, img_width, img_height, precision, clamp)
+    return out_of_bounds
 
-def normalize_bbox_in_label_files_of_dirs(img_width: int, img_height: int, target_directories: List[str]) -> None:
+def normalize_bbox_in_label_files_of_dir(root: str, img_width: int, img_height: int, skip_directories: List[str] = ['rico'], skip_files: List[str] = ['test.txt', 'train.txt', 'val.txt'],
+                                         batch_size: int = 10000, precision: int = 6, clamp: bool = True) -> int:
     """
     Recursively normalize all bounding boxes in a dataset directory
 
     Skips by default directories named 'rico' and files named 'test.txt', 'train.txt', and 'val.txt'
+
+    Returns the amount of bounding boxes which were out of bounds
+    """
+    return normalize_bbox_in_label_files_batched(annotation_files(root, skip_directories, skip_files), img_width, img_height, batch_size, precision, clamp)
+
+def normalize_bbox_in_label_files_of_dirs(img_width: int, img_height: int, target_directories: List[str],
+                                          batch_size: int = 10000, precision: int = 6, clamp: bool = True) -> int:
+    """
+    Recursively normalize all bounding boxes in the provided directories
+
+    Label files are loaded in batches of batch_size files into a single array and normalized at once
+
+    Returns the amount of bounding boxes which were out of bounds
     """
-    for file in generators.annotation_files_in_dirs(target_directories):
-        logging.debug(f"Normalizing {file}...")
-        normalize_bbox_in_label_file(file, img_width, img_height)
+    return normalize_bbox_in_label_files_batched(generators.annotation_files_in_dirs(target_directories), img_width, img_height, batch_size, precision, clamp)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, format='%(levelname)s %(message)s')
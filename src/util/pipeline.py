@@ -0,0 +1,57 @@
+import queue
+import threading
+import logging
+from typing import Callable
+
+STOP = object()
+
+def start_stage(process: Callable[[object], None], queue_size: int = 64, on_drop: Callable[[object], None] = None) -> dict:
+    """
+    Start a pipeline stage which calls process for every submitted item in a background thread
+
+    The queue of the stage is bounded by queue_size, submitting blocks while the queue is full.
+    After the first failure all further items are dropped and the error is raised by submit() or finish().
+    on_drop is called with the failed item and every dropped item, e.g. to release resources held for them.
+
+    Returns the stage as dictionary to be passed to submit() and finish()
+    """
+    stage = {'queue': queue.Queue(maxsize=queue_size), 'errors': []}
+
+    def run() -> None:
+        while True:
+            item = stage['queue'].get()
+            if item is STOP:
+                break
+            if not stage['errors']:
+                try:
+                    process(item)
+                    continue
+                except Exception as e:
+                    logging.exception("Pipeline stage failed on %s", item)
+                    stage['errors'].append(e)
+            if on_drop is not None:
+                try:
+                    on_drop(item)
+                except Exception:
+                    logging.exception("Dropping %s failed", item)
+
+    stage['thread'] = threading.Thread(target=run, daemon=True)
+    stage['thread'].start()
+    return stage
+
+def submit(stage: dict, item: object) -> None:
+    """
+    Submit an item to a pipeline stage, blocks while the queue of the stage is full
+    """
+    if stage['errors']:
+        raise stage['errors'][0]
+    stage['queue'].put(item)
+
+def finish(stage: dict) -> None:
+    """
+    Wait until a pipeline stage processed all submitted items and stop it
+    """
+    stage['queue'].put(STOP)
+    stage['thread'].join()
+    if stage['errors']:
+        raise stage['errors'][0]
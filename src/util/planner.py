@@ -0,0 +1,136 @@
+import math
+import threading
+import logging
+from typing import Dict
+from typing import List
+from typing import Generator
+
+def create_planner(targets: Dict[str, int], max_widget_count: int, layouts: List[str] = None,
+                   split_ratio: tuple = (0.7, 0.1, 0.2), splits: List[str] = ['train', 'val', 'test']) -> dict:
+    """
+    Create a planner choosing generator invocations until every class reached its instance target
+
+    targets: amount of instances to generate per widget type (e.g. {'button': 500, 'slider': 800})
+    max_widget_count: maximum amount of widgets per render
+    layouts: layouts to rotate through (None for the default layout of the generator)
+    split_ratio: ratio of instances per class in the train, val and test split
+
+    Returns the planner as dictionary to be passed to the other functions of this module
+    """
+    return {
+        'targets': dict(targets),
+        'max_widget_count': max_widget_count,
+        'layouts': layouts or [None],
+        'split_ratio': dict(zip(splits, split_ratio)),
+        'tallies': {widget: 0 for widget in targets},
+        'split_tallies': {split: {widget: 0 for widget in targets} for split in splits},
+        'expected': {},
+        'condition': threading.Condition(),
+        'invocations': 0,
+        'stopped': False,
+    }
+
+def deficits(planner: dict) -> Dict[str, float]:
+    """
+    Remaining instances per class, counting the expected instances of renders in flight
+    """
+    remaining = {widget: target - planner['tallies'][widget] for widget, target in planner['targets'].items()}
+    for expected in planner['expected'].values():
+        for widget, amount in expected.items():
+            remaining[widget] -= amount
+    return remaining
+
+def choose_render(planner: dict) -> dict:
+    """
+    Choose widget list, widget count and layout of the next render
+
+    The generator picks widgets uniformly from the widget list, so only classes with at least half of the largest deficit are included
+    and the widget count is capped by the remaining instances of those classes to avoid overshooting the targets.
+
+    Returns None if the targets are covered by the finished and in flight renders
+    """
+    remaining = {widget: deficit for widget, deficit in deficits(planner).items() if deficit > 0}
+    if not remaining:
+        return None
+    largest = max(remaining.values())
+    widgets = [widget for widget, deficit in remaining.items() if deficit >= largest / 2]
+    widget_count = max(1, min(planner['max_widget_count'], math.ceil(sum(remaining[widget] for widget in widgets))))
+    layout = planner['layouts'][planner['invocations'] % len(planner['layouts'])]
+    return {'widgets': widgets, 'widget_count': widget_count, 'layout': layout}
+
+def plan_jobs(planner: dict, max_invocations: int, start: int = 0, wait_interval: float = 1.0) -> Generator[dict, None, None]:
+    """
+    Generator for render jobs until all targets are reached or max_invocations renders were planned
+
+    While the renders in flight are expected to cover the targets, the generator waits for their results
+    and continues if they fell short. Planning ends as soon as the planner is stopped (see stop_planner()).
+    """
+    condition = planner['condition']
+    index = start
+    while planner['invocations'] < max_invocations:
+        with condition:
+            render = choose_render(planner)
+            while render is None and planner['expected'] and not planner['stopped']:
+                condition.wait(wait_interval)
+                render = choose_render(planner)
+            if planner['stopped']:
+                logging.warning("Stopped planning after %i renders", planner['invocations'])
+                return
+            if render is None:
+                return
+            job = dict(render, index=index, output_file=f"ui_{'-'.join(render['widgets'])}_{index}.jpg")
+            planner['expected'][index] = {widget: render['widget_count'] / len(render['widgets']) for widget in render['widgets']}
+            planner['invocations'] += 1
+        index += 1
+        yield job
+    logging.warning("Stopped planning after %i renders, remaining instances: %s", max_invocations,
+                    {widget: deficit for widget, deficit in deficits(planner).items() if deficit > 0})
+
+def stratified_split(planner: dict, class_counts: Dict[str, int]) -> str:
+    """
+    Choose the split lagging the most behind its ratio for the classes of a sample
+    """
+    totals = {widget: planner['tallies'].get(widget, 0) + count for widget, count in class_counts.items()}
+    best_split = None
+    best_lag = None
+    for split, ratio in planner['split_ratio'].items():
+        lag = sum(count * (ratio * totals[widget] - planner['split_tallies'][split].get(widget, 0)) for widget, count in class_counts.items())
+        if best_lag is None or lag > best_lag:
+            best_split, best_lag = split, lag
+    return best_split
+
+def record_sample(planner: dict, job: dict, class_counts: Dict[str, int], split: str = None) -> str:
+    """
+    Tally the classes of a finished render and release its expectation
+
+    Assigns a stratified split to the sample if none is provided
+
+    Returns the split of the sample
+    """
+    with planner['condition']:
+        if split is None:
+            split = stratified_split(planner, class_counts)
+        for widget, count in class_counts.items():
+            if widget in planner['tallies']:
+                planner['tallies'][widget] += count
+                planner['split_tallies'][split][widget] += count
+        if job is not None:
+            planner['expected'].pop(job['index'], None)
+        planner['condition'].notify_all()
+    return split
+
+def release_job(planner: dict, job: dict) -> None:
+    """
+    Release the expectation of a render which failed or was dropped
+    """
+    with planner['condition']:
+        planner['expected'].pop(job['index'], None)
+        planner['condition'].notify_all()
+
+def stop_planner(planner: dict) -> None:
+    """
+    Stop planning further renders (e.g. after the post-processing failed), waiting plan_jobs() generators return
+    """
+    with planner['condition']:
+        planner['stopped'] = True
+        planner['condition'].notify_all()
@@ -0,0 +1,120 @@
+import os
+import glob
+import logging
+import yaml
+from typing import Dict
+from typing import List
+
+from util import replace
+
+DATA_FILE = 'custom.data'
+# Entries of a data file holding paths, which are resolved against its root entry
+DATA_PATH_KEYS = ('train', 'valid', 'names')
+# List and data files in the top level of a dataset, which may hold absolute paths of older datasets
+LEGACY_PATTERNS = ('*.txt', '*.data')
+
+def root_relative_path(path: str, root: str) -> str:
+    """
+    Path relative to the root of a dataset, prefixed with ./ (e.g. ./images/train/ui_button_0.jpg)
+
+    Ultralytics resolves ./ lines of a list file against the folder of the list file, so list files in the root stay valid wherever
+    the dataset is moved. Darknet resolves them against its working directory and ignores the root entry of the data file.
+    Paths outside of root (e.g. ./../part_0000/... in merged list files) only stay valid if their folders are moved along.
+    """
+    return './' + os.path.relpath(path, root).replace(os.sep, '/')
+
+def read_data_file(path: str) -> Dict[str, str]:
+    """
+    Read the key=value entries of a darknet data file
+    """
+    values = {}
+    with open(path, 'r') as f:
+        for line in f:
+            key, separator, value = line.strip().partition('=')
+            if separator:
+                values[key.strip()] = value.strip()
+    return values
+
+def write_data_file(path: str, values: Dict[str, str]) -> None:
+    """
+    Atomically write the key=value entries of a darknet data file
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        f.writelines(f"{key}={value}\n" for key, value in values.items())
+    os.replace(temporary_path, path)
+
+def resolve_data_file(path: str) -> Dict[str, str]:
+    """
+    Read a darknet data file and resolve its relative paths against its root entry (or the folder of the data file without root)
+    """
+    values = read_data_file(path)
+    root = values.get('root', os.path.dirname(os.path.abspath(path)))
+    for key in DATA_PATH_KEYS:
+        if key in values and not os.path.isabs(values[key]):
+            values[key] = os.path.normpath(os.path.join(root, values[key]))
+    return values
+
+def set_root(dataset_folder: str, root: str = None) -> List[str]:
+    """
+    Point the dataset yaml files and the data file of a dataset at a new root
+
+    Only the files in the top level of the dataset folder are read, list files with root-relative paths stay untouched.
+    root: new root of the dataset, defaults to the current absolute location of the dataset folder
+
+    Returns the updated files
+    """
+    root = os.path.abspath(root or dataset_folder)
+    updated = []
+    for path in sorted(glob.glob(os.path.join(dataset_folder, '*.yaml'))):
+        with open(path, 'r') as f:
+            dataset_yaml = yaml.safe_load(f)
+        if not isinstance(dataset_yaml, dict) or 'names' not in dataset_yaml or dataset_yaml.get('path') == root:
+            continue
+        dataset_yaml['path'] = root
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            yaml.dump(dataset_yaml, f)
+        os.replace(temporary_path, path)
+        updated.append(path)
+    data_file = os.path.join(dataset_folder, DATA_FILE)
+    if os.path.exists(data_file):
+        values = read_data_file(data_file)
+        if values.get('root') != root:
+            values['root'] = root
+            write_data_file(data_file, values)
+            updated.append(data_file)
+    return updated
+
+def legacy_files(dataset_folder: str) -> List[str]:
+    """
+    List and data files in the top level of a dataset folder, the tree of the dataset isn't walked
+    """
+    return sorted(path for pattern in LEGACY_PATTERNS for path in glob.glob(os.path.join(dataset_folder, pattern)))
+
+def rewrite_legacy_paths(files: List[str], old_root: str, new_root: str, chunk_size: int = 64 << 20) -> List[str]:
+    """
+    Rewrite absolute paths below old_root to new_root in list and data files, see replace.replace_prefix_in_file()
+
+    Returns the rewritten files, files without paths below old_root aren't touched
+    """
+    prefixes = (os.path.join(os.path.abspath(old_root), ''), os.path.join(os.path.abspath(new_root), ''))
+    rewritten = [file for file in files if replace.replace_prefix_in_file(prefixes, file, chunk_size)]
+    logging.info("Rewrote %i of %i files from %s to %s", len(rewritten), len(files), old_root, new_root)
+    return rewritten
+
+def relocate_dataset(dataset_folder: str, root: str = None, old_root: str = None, files: List[str] = None, chunk_size: int = 64 << 20) -> Dict[str, List[str]]:
+    """
+    Relocate a dataset to a new root
+
+    Datasets with root-relative list files only need their yaml and data files pointed at the new root.
+    old_root: previous root of a dataset with absolute paths, which are rewritten in the list and data files of the dataset
+    files: further list files with absolute paths below old_root (e.g. outside of the dataset folder)
+
+    Returns a dictionary with the rewritten list files and the updated yaml and data files
+    """
+    root = os.path.abspath(root or dataset_folder)
+    rewritten = []
+    if old_root is not None:
+        rewritten = rewrite_legacy_paths(legacy_files(dataset_folder) + list(files or []), old_root, root, chunk_size)
+    return {'rewritten': rewritten, 'updated': set_root(dataset_folder, root)}
@@ -1,9 +1,13 @@
 import os
+import re
+import mmap
+import shutil
 from typing import List
 from typing import Generator
 import logging
 
 from util import generators
+from util import metrics
 
 def replace_in_file(replace: tuple, file: str):
     """
@@ -21,21 +25,57 @@ def replace_in_file(replace: tuple, file: str):
         f.writelines(lines)
         f.truncate()
 
+def replace_prefix_in_file(replace: tuple, file: str, chunk_size: int = 64 << 20) -> bool:
+    """
+    Replace the path prefix replace[0] with replace[1] in a file of any size, streaming it in chunks through a memory map
+
+    Only occurences at the start of a line or of the value of a key=value line (e.g. train=/data/custom/train.txt) are replaced,
+    so paths merely containing replace[0] (e.g. /mnt/data/custom for /data/custom) stay untouched.
+    Files without replace[0] are left untouched. Otherwise the file is written to a temporary file next to it which replaces it at the end,
+    so readers never see a half rewritten file. Chunks end at a line break, so a line can't be split between two chunks.
+
+    Returns whether the file was rewritten
+    """
+    old, new = (value.encode() for value in replace)
+    if not old or os.path.getsize(file) == 0:
+        return False
+    pattern = re.compile(rb'(?m)^((?:\w+[ \t]*=[ \t]*)?)' + re.escape(old))
+    temporary_path = file + '.tmp'
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if pattern.search(data) is None:
+            return False
+        logging.debug("Replacing %s with %s in %s", replace[0], replace[1], file)
+        with open(temporary_path, 'wb') as out:
+            start = 0
+            while start < len(data):
+                end = min(start + chunk_size, len(data))
+                if end < len(data):
+                    line_end = data.rfind(b'\n', start, end)
+                    if line_end == -1:
+                        line_end = data.find(b'\n', end)
+                    end = len(data) if line_end == -1 else line_end + 1
+                out.write(pattern.sub(lambda match: match.group(1) + new, data[start:end]))
+                start = end
+    shutil.copymode(file, temporary_path)
+    os.replace(temporary_path, file)
+    return True
+
 def replace_paths_in_files_of_dir(root: str, replace: tuple, skip_directories: List[str] = ['rico', 'test', 'train', 'val'], skip_files: List[str] = ['classes.names']) -> None:
     """
     Recursively replace all paths in a dataset directory
 
     Skips by default directories named 'rico', 'test', 'train', and 'val' and files named 'classes.names'
+    Files are streamed with replace_prefix_in_file(), files without the old path aren't rewritten.
     """
     if len(replace) != 2:
         raise ValueError("Argument replace must be a tuple of length 2")
     for file in generators.dataset_files_in_dir(root, skip_directories, skip_files):
         logging.debug(f"Replacing paths in {file}...")
-        replace_in_file(replace, file)
+        replace_prefix_in_file(replace, file)
 
 def replace_class_names_with_id_in_file(class_names: List[str], file: str) -> None:
     logging.debug(f"Replacing class names in {file}...")
-    with open(file, 'r+') as f:
+    with metrics.timed('class_ids'), open(file, 'r+') as f:
         for a_class in class_names:
             replace_in_file((a_class, str(class_names.index(a_class))), file)
 
@@ -0,0 +1,124 @@
+import io
+import os
+import json
+import glob
+import shutil
+import tarfile
+import logging
+from typing import Dict
+from typing import List
+
+def shard_files(folder: str, split: str) -> List[str]:
+    """
+    Sorted list of the finished shard files of a split
+    """
+    return sorted(glob.glob(os.path.join(folder, f"{split}-*.tar")))
+
+def index_path(folder: str, split: str) -> str:
+    """
+    Path of the index file of a split, which holds the offsets of all members in the shards
+    """
+    return os.path.join(folder, f"{split}.index.jsonl")
+
+def open_shard_writer(folder: str, split: str, max_size: int = 256 << 20, max_count: int = 10000, staging_folder: str = None) -> dict:
+    """
+    Create a writer packing samples of a split into size-bounded tar shards (WebDataset layout)
+
+    Shards are named <split>-<number>.tar and numbered after the already existing shards of the split.
+    A shard is written as .partial file and only renamed once it is complete, left over partial shards are removed.
+    With a staging folder (e.g. on a tmpfs) shards are written there and copied into folder in one piece once they are complete.
+
+    Returns the writer as dictionary to be passed to write_sample() and close_shard_writer()
+    """
+    os.makedirs(folder, exist_ok=True)
+    for partial in glob.glob(os.path.join(folder, f"{split}-*.tar.partial")):
+        logging.warning("Removing incomplete shard %s", partial)
+        os.remove(partial)
+    return {
+        'folder': folder,
+        'staging_folder': staging_folder if staging_folder is not None else folder,
+        'split': split,
+        'max_size': max_size,
+        'max_count': max_count,
+        'number': len(shard_files(folder, split)),
+        'tar': None,
+        'entries': [],
+        'records': [],
+    }
+
+def start_shard(writer: dict) -> None:
+    shard = f"{writer['split']}-{writer['number']:06d}.tar"
+    writer['shard'] = shard
+    writer['tar'] = tarfile.open(os.path.join(writer['staging_folder'], shard + '.partial'), 'w')
+    writer['size'] = 0
+    writer['entries'] = []
+    writer['records'] = []
+
+def finish_shard(writer: dict) -> List[dict]:
+    """
+    Complete the current shard of a writer and append its members to the index of the split
+
+    Returns the records of all samples in the completed shard
+    """
+    if writer['tar'] is None:
+        return []
+    writer['tar'].close()
+    writer['tar'] = None
+    shard_path = os.path.join(writer['folder'], writer['shard'])
+    if writer['staging_folder'] != writer['folder']:
+        staged_path = os.path.join(writer['staging_folder'], writer['shard'] + '.partial')
+        shutil.copyfile(staged_path, shard_path + '.partial')
+        os.remove(staged_path)
+    os.replace(shard_path + '.partial', shard_path)
+    with open(index_path(writer['folder'], writer['split']), 'a') as index:
+        for entry in writer['entries']:
+            index.write(json.dumps(entry, separators=(',', ':')) + '\n')
+    writer['number'] += 1
+    logging.debug("Finished shard %s with %i samples", shard_path, len(writer['entries']))
+    return writer['records']
+
+def write_sample(writer: dict, key: str, members: Dict[str, bytes], record: dict = None) -> List[dict]:
+    """
+    Write the members of a sample (e.g. {'jpg': ..., 'txt': ..., 'json': ...}) as <key>.<extension> into the current shard
+
+    A new shard is started if the sample would exceed the size or count limit of the current shard.
+
+    Returns the records of the samples in a shard completed by this call
+    """
+    completed = []
+    sample_size = sum(len(data) + 1024 for data in members.values())
+    if writer['tar'] is not None and writer['entries'] and \
+            (writer['size'] + sample_size > writer['max_size'] or len(writer['entries']) >= writer['max_count']):
+        completed = finish_shard(writer)
+    if writer['tar'] is None:
+        start_shard(writer)
+    entry = {'key': key, 'shard': writer['shard'], 'members': {}}
+    for extension, data in members.items():
+        info = tarfile.TarInfo(f"{key}.{extension}")
+        info.size = len(data)
+        writer['tar'].addfile(info, io.BytesIO(data))
+        # The data of the member ends at the current offset of the archive, padded to full blocks
+        offset_data = writer['tar'].offset - (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        entry['members'][extension] = [offset_data, info.size]
+    writer['size'] += sample_size
+    writer['entries'].append(entry)
+    if record is not None:
+        writer['records'].append(dict(record, shard=writer['shard']))
+    return completed
+
+def close_shard_writer(writer: dict) -> List[dict]:
+    """
+    Complete the last shard of a writer
+
+    Returns the records of the samples in the completed shard
+    """
+    return finish_shard(writer)
+
+def read_member(folder: str, entry: dict, extension: str) -> bytes:
+    """
+    Read a single member of a sample using its index entry, without scanning the shard
+    """
+    offset, size = entry['members'][extension]
+    with open(os.path.join(folder, entry['shard']), 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
@@ -0,0 +1,93 @@
+import os
+import time
+import subprocess
+import logging
+from typing import List
+from typing import Optional
+
+from util import metrics
+
+JPEG_END_OF_IMAGE = b'\xff\xd9'
+
+def is_jpeg_complete(path: str) -> bool:
+    """
+    Check if a JPEG file has been written completely by looking for the end of image marker
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(-len(JPEG_END_OF_IMAGE), os.SEEK_END)
+            return f.read() == JPEG_END_OF_IMAGE
+    except OSError:
+        return False
+
+def file_sizes(files: List[str]) -> Optional[List[int]]:
+    """
+    Get the sizes of all files
+
+    Returns None if any of the files doesn't exist (yet)
+    """
+    try:
+        return [os.path.getsize(file) for file in files]
+    except OSError:
+        return None
+
+def files_complete(files: List[str]) -> bool:
+    """
+    Check if all files exist, are non-empty and every JPEG file has its end of image marker
+    """
+    sizes = file_sizes(files)
+    if sizes is None or 0 in sizes:
+        return False
+    return all(is_jpeg_complete(file) for file in files if file.endswith('.jpg'))
+
+def stop_process(process: subprocess.Popen, grace_period: float = 1.0) -> None:
+    """
+    Terminate a process and kill it if it doesn't exit within the grace period
+    """
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(grace_period)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def run_until_files_complete(args: List[str], cwd: str, files: List[str], timeout: float = None,
+                             poll_interval: float = 0.05, stable_polls: int = 2) -> bool:
+    """
+    Run a process and end it as soon as all expected output files are complete
+
+    Files are considered complete once they exist, are complete according to files_complete()
+    and their sizes didn't change for stable_polls consecutive polls.
+    The process is stopped when the files are complete or the timeout (in seconds) expired.
+
+    Returns True if all files are complete
+    """
+    with metrics.timed('spawn'):
+        process = subprocess.Popen(args, cwd=cwd)
+    start = time.monotonic()
+    last_sizes = None
+    stable = 0
+    try:
+        with metrics.timed('wait'):
+            while True:
+                sizes = file_sizes(files)
+                if sizes is not None and sizes == last_sizes and files_complete(files):
+                    stable += 1
+                else:
+                    stable = 0
+                last_sizes = sizes
+                if stable >= stable_polls:
+                    logging.debug("Output files %s complete after %.2fs", ' '.join(files), time.monotonic() - start)
+                    return True
+                if process.poll() is not None:
+                    # Files are final once the process exited on its own
+                    return files_complete(files)
+                if timeout is not None and time.monotonic() - start > timeout:
+                    logging.warning("Process %s timed out after %.2fs", args[0], timeout)
+                    metrics.increment('timeouts')
+                    return False
+                time.sleep(poll_interval)
+    finally:
+        stop_process(process)
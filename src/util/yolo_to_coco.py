@@ -1,63 +1,172 @@
 import os
 import json
+import shutil
+import struct
+import tempfile
+import collections
+from typing import List
+from typing import Tuple
+from typing import Generator
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
+# JPEG start of frame markers containing the image size (excluding DHT, JPG and DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(image_path: str) -> Tuple[int, int]:
+    """
+    Read the size of a JPEG image from its header without decoding the image
+
+    Returns None if the file isn't a JPEG image or has no start of frame segment
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] == 0xFF:
+                # Fill byte, the marker starts one byte later
+                f.seek(-1, os.SEEK_CUR)
+                continue
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if marker[1] in JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>xHH', f.read(5))
+                return width, height
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
 def get_image_info(image_path):
+    size = jpeg_size(image_path)
+    if size is not None:
+        return size
     with Image.open(image_path) as img:
         width, height = img.size
     return width, height
 
-def convert_yolo_to_coco(yolo_folder, image_folder):
+def parse_yolo_label_file(annotation_path: str) -> List[Tuple[int, float, float, float, float]]:
+    """
+    Parse a YOLO label file into a list of (category_id, x_center, y_center, width, height)
+    """
+    rows = []
+    with open(annotation_path, 'r') as file:
+        for line in file:
+            tokens = line.split()
+            if len(tokens) < 5:
+                continue
+            category_id, x_center, y_center, w, h = map(float, tokens[:5])
+            rows.append((int(category_id), x_center, y_center, w, h))
+    return rows
+
+def parse_yolo_label_files(annotation_paths: List[str]) -> List[List[Tuple[int, float, float, float, float]]]:
+    """
+    Parse a batch of YOLO label files, see parse_yolo_label_file()
+    """
+    return [parse_yolo_label_file(annotation_path) for annotation_path in annotation_paths]
+
+def parse_yolo_label_files_bounded(annotation_paths: List[str], workers: int = None, batch_size: int = 256) -> Generator[list, None, None]:
+    """
+    Generator for the parsed label files in order, using a process pool with a bounded amount of batches in flight
+
+    At most twice as many batches as workers are submitted ahead of the consumer, so memory doesn't grow with the amount of files
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = workers * 2
+        pending = collections.deque()
+        try:
+            for start in range(0, len(annotation_paths), batch_size):
+                if len(pending) >= window:
+                    yield from pending.popleft().result()
+                pending.append(executor.submit(parse_yolo_label_files, annotation_paths[start:start + batch_size]))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def yolo_samples(yolo_folder: str, image_folder: str, image_size: Tuple[int, int] = None, workers: int = None) -> Generator[Tuple[str, int, int, list], None, None]:
+    """
+    Generator for the samples of a YOLO label folder
+
+    Label files are parsed in a process pool with the provided amount of workers (all cores by default, no pool for 1 worker),
+    with a bounded amount of parsed batches in flight (see parse_yolo_label_files_bounded()).
+    The image size is taken from image_size if provided, otherwise it is read from the header of each image.
+
+    Returns a generator of (image_filename, width, height, rows) in order of the label file names
+    """
+    filenames = sorted(filename for filename in os.listdir(yolo_folder) if filename.endswith('.txt'))
+    annotation_paths = [os.path.join(yolo_folder, filename) for filename in filenames]
+    if workers == 1:
+        parsed = map(parse_yolo_label_file, annotation_paths)
+    else:
+        parsed = parse_yolo_label_files_bounded(annotation_paths, workers)
+    try:
+        for filename, rows in zip(filenames, parsed):
+            image_filename = os.path.splitext(filename)[0] + '.jpg'
+            if image_size is None:
+                width, height = get_image_info(os.path.join(image_folder, image_filename))
+            else:
+                width, height = image_size
+            yield image_filename, width, height, rows
+    finally:
+        if hasattr(parsed, 'close'):
+            parsed.close()
+
+def coco_annotation(ann_id: int, img_id: int, row: Tuple[int, float, float, float, float], width: int, height: int) -> dict:
+    category_id, x_center, y_center, w, h = row
+
+    # Convert x_center, y_center, w, h from normalized YOLO format to COCO format
+    x_min = (x_center - w / 2) * width
+    y_min = (y_center - h / 2) * height
+    bbox_width = w * width
+    bbox_height = h * height
+
+    return {
+        "id": ann_id,
+        "image_id": img_id,
+        "category_id": category_id,
+        "bbox": [x_min, y_min, bbox_width, bbox_height],
+        "area": bbox_width * bbox_height,
+        "segmentation": [],
+        "iscrowd": 0
+    }
+
+def convert_yolo_to_coco(yolo_folder, image_folder, image_size=None, workers=None):
+    """
+    Convert a YOLO label folder into COCO images and annotations held in memory
+
+    Use yolo_to_coco_annotation() for large datasets, which streams the result into the output file
+    """
     categories = set()
     annotations = []
     images = []
-    img_id_map = {}
     ann_id = 1
-    img_id = 1
-
-    for filename in os.listdir(yolo_folder):
-        if filename.endswith('.txt'):
-            image_filename = filename.split('.')[0] + '.jpg'
-            image_path = os.path.join(image_folder, image_filename)
-            width, height = get_image_info(image_path)
-
-            images.append({
-                "id": img_id,
-                "width": width,
-                "height": height,
-                "file_name": image_filename
-            })
-            img_id_map[image_filename] = img_id
-            img_id += 1
-
-            annotation_path = os.path.join(yolo_folder, filename)
-            with open(annotation_path, 'r') as file:
-                for line in file:
-                    category_id, x_center, y_center, w, h = map(float, line.strip().split())
-                    categories.add(category_id)
-
-                    # Convert x_center, y_center, w, h from normalized YOLO format to COCO format
-                    x_min = (x_center - w / 2) * width
-                    y_min = (y_center - h / 2) * height
-                    bbox_width = w * width
-                    bbox_height = h * height
-
-                    annotations.append({
-                        "id": ann_id,
-                        "image_id": img_id_map[image_filename],
-                        "category_id": int(category_id),
-                        "bbox": [x_min, y_min, bbox_width, bbox_height],
-                        "area": bbox_width * bbox_height,
-                        "segmentation": [],
-                        "iscrowd": 0
-                    })
-                    ann_id += 1
-
-    return categories, annotations
-
-
-def format_categories(categories):
-    return [{"id": int(cat_id), "name": str(cat_id)} for cat_id in categories]
+
+    for img_id, (image_filename, width, height, rows) in enumerate(yolo_samples(yolo_folder, image_folder, image_size, workers), start=1):
+        images.append({
+            "id": img_id,
+            "width": width,
+            "height": height,
+            "file_name": image_filename
+        })
+        for row in rows:
+            categories.add(row[0])
+            annotations.append(coco_annotation(ann_id, img_id, row, width, height))
+            ann_id += 1
+
+    return categories, images, annotations
+
+
+def format_categories(categories, class_names=None):
+    """
+    Format category ids as COCO categories, named after class_names if provided
+    """
+    if class_names is not None:
+        return [{"id": i, "name": class_name} for i, class_name in enumerate(class_names)]
+    return [{"id": int(cat_id), "name": str(cat_id)} for cat_id in sorted(categories)]
 
 
 def save_coco_format(output_json_path, output_json_name, images, annotations, categories):
@@ -67,20 +176,54 @@ def save_coco_format(output_json_path, output_json_name, images, annotations, ca
         "categories": categories
     }
 
-    os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+    os.makedirs(output_json_path, exist_ok=True)
     with open(os.path.join(output_json_path, output_json_name), 'w') as f:
         json.dump(coco_format, f, indent=4)
 
 
-def yolo_to_coco_annotation(yolo_folder, image_folder, output_json_path, output_json_name):
-    images = []
-    categories, annotations = convert_yolo_to_coco(yolo_folder, image_folder)
-    categories = format_categories(categories)
-    save_coco_format(output_json_path, output_json_name, images, annotations, categories)
+def write_coco_streaming(output_file: str, samples: Generator[Tuple[str, int, int, list], None, None], class_names: List[str] = None) -> None:
+    """
+    Write samples into a COCO annotation file without holding images or annotations in memory
+
+    Images are written directly, annotations are buffered in a temporary file and appended afterwards
+    """
+    categories = set()
+    ann_id = 1
+    with open(output_file, 'w') as f, tempfile.TemporaryFile('w+', dir=os.path.dirname(output_file)) as annotations:
+        f.write('{"images": [')
+        for img_id, (image_filename, width, height, rows) in enumerate(samples, start=1):
+            if img_id > 1:
+                f.write(',')
+            f.write(json.dumps({"id": img_id, "width": width, "height": height, "file_name": image_filename}))
+            for row in rows:
+                categories.add(row[0])
+                if ann_id > 1:
+                    annotations.write(',')
+                annotations.write(json.dumps(coco_annotation(ann_id, img_id, row, width, height)))
+                ann_id += 1
+        f.write('], "annotations": [')
+        annotations.seek(0)
+        shutil.copyfileobj(annotations, f)
+        f.write('], "categories": ')
+        f.write(json.dumps(format_categories(categories, class_names)))
+        f.write('}')
+
+
+def yolo_to_coco_annotation(yolo_folder, image_folder, output_json_path, output_json_name, class_names=None, image_size=None, workers=None):
+    """
+    Convert a YOLO label folder into a COCO annotation file
+
+    class_names: names of the categories by class id (category ids are used as names if not provided)
+    image_size: (width, height) of all images, read from the image headers if not provided
+    workers: amount of processes parsing label files (all cores by default)
+    """
+    os.makedirs(output_json_path, exist_ok=True)
+    samples = yolo_samples(yolo_folder, image_folder, image_size, workers)
+    write_coco_streaming(os.path.join(output_json_path, output_json_name), samples, class_names)
 
 if __name__ == '__main__':
     yolo_folder = os.path.join(os.getcwd(), 'data', 'val')
     image_folder = os.path.join(os.getcwd(), 'data', 'val')
     output_json_path = os.path.join(os.getcwd(), 'data/rico/annotations')
     output_json_name = 'instances_val.json'
-    yolo_to_coco_annotation(yolo_folder, image_folder, output_json_path, output_json_name)
\ No newline at end of file
+    yolo_to_coco_annotation(yolo_folder, image_folder, output_json_path, output_json_name)